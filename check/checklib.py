@@ -9,6 +9,12 @@ show_hide_button_aware() makes a series of buttons that check/uncheck checkboxes
 
 dumfig() makes a dummy figure with only the legend visible in order to place the legend anywhere in a grid layout
 
+flat_table() converts nested dictionaries like {date:{window:{mod:{specID:value}}}} to a flat table of numpy arrays
+
+group_by() gives the rows of each group of a flat table, to make one ColumnDataSource per group from slices of the table
+
+filtered_source() puts all the rows of a flat table in one ColumnDataSource with a CheckboxGroup that shows/hides groups of rows through an IndexFilter, the number of renderers does not grow with the number of groups
+
 """
 
 #############
@@ -19,7 +25,7 @@ import numpy as np
 
 import bokeh
 from bokeh.plotting import figure
-from bokeh.models import Legend, CustomJS, ColumnDataSource, HoverTool, CheckboxGroup, Button, Div
+from bokeh.models import Legend, CustomJS, ColumnDataSource, HoverTool, CheckboxGroup, Button, Div, CDSView, IndexFilter, GroupFilter
 from bokeh.layouts import gridplot,widgetbox
 from bokeh.resources import CDN
 from bokeh.embed import file_html
@@ -56,6 +62,116 @@ def flatten(obj,keep=[]):
 		else:
 			yield item
 
+def flat_table(dic,names=['date','window','mod','specID'],value='value'):
+	'''
+	converts a nested dictionary {date:{window:{mod:{specID:value}}}} to a flat table in one pass
+
+	- dic: nested dictionary with the same depth everywhere
+	- names: the names of the keys at each level of dic, the depth of dic is len(names)
+	- value: the name of the values column
+
+	returns an OrderedDict of numpy arrays {'date':[...],'window':[...],'mod':[...],'specID':[...],'value':[...]} with one row per value, in the order of the dictionary
+
+	the dictionary is walked level by level, the keys and values of the last level are copied in bulk and the keys of the upper levels are repeated with np.repeat
+	'''
+	level = [((),dic)]
+	for it in range(len(names)-1):
+		level = [(path+(key,),sub[key]) for path,sub in level for key in sub]
+
+	counts = []
+	leaf_keys = []
+	leaf_values = []
+	for path,leaf in level:
+		counts.append(len(leaf))
+		leaf_keys.extend(leaf.keys())
+		leaf_values.extend(leaf.values())
+
+	table = collections.OrderedDict()
+	for it,name in enumerate(names[:-1]):
+		table[name] = np.repeat(np.array([path[it] for path,leaf in level]),counts)
+	table[names[-1]] = np.array(leaf_keys)
+	table[value] = np.array(leaf_values)
+
+	return table
+
+def group_by(table,keys):
+	'''
+	- table: flat table returned by flat_table()
+	- keys: list of column names of the table, e.g. ['date','window','mod']
+
+	returns an OrderedDict {(date,window,mod):rows} where rows is a numpy array of the indices of the rows of each group
+	the groups are in order of first appearance in the table, and the rows of each group keep the order of the table
+
+	the source of one group can be made with ColumnDataSource(data={name:table[name][rows] for name in table})
+	'''
+	length = len(table[keys[0]])
+
+	# one integer code per row for the combination of keys
+	codes = np.zeros(length,dtype=np.int64)
+	for key in keys:
+		uniques,inverse = np.unique(table[key],return_inverse=True)
+		codes = codes*len(uniques)+inverse.ravel()
+
+	group_codes,first,inverse = np.unique(codes,return_index=True,return_inverse=True)
+	inverse = inverse.ravel()
+
+	# number the groups by first appearance
+	rank = np.empty(len(first),dtype=np.int64)
+	rank[np.argsort(first)] = np.arange(len(first))
+	inverse = rank[inverse]
+
+	order = np.argsort(inverse,kind='mergesort')
+	rows = np.split(order,np.cumsum(np.bincount(inverse,minlength=len(first)))[:-1])
+
+	return collections.OrderedDict([(tuple(table[key][row].item() for key in keys),group_rows) for row,group_rows in zip(np.sort(first),rows)])
+
+def filtered_source(table,keys,separator='-',height=400):
+	'''
+	Put all the rows of a flat table in one ColumnDataSource, with a CheckboxGroup that has one checkbox per group of rows
+
+	- table: flat table returned by flat_table()
+	- keys: the columns that define the groups, e.g. ['date','window','mod'], the label of each checkbox is the values of keys joined with separator
+	- height: height of the CheckboxGroup
+
+	Output: (source,checkbox,index_filter,checkbox_code,iterable)
+		- source: ColumnDataSource with all the columns of the table, the rows are sorted by group and a 'group' column has the checkbox number of each row
+		- checkbox: CheckboxGroup with all the groups checked
+		- index_filter: IndexFilter with the rows of the checked groups, give view=CDSView(source=source,filters=[index_filter]) to the renderers of the source
+		  other filters can be added to the view, e.g. a GroupFilter to draw the rows of each 'mod' with a different marker
+		- checkbox_code: the callback code of the CheckBoxGroup, it updates index_filter with the rows of the checked groups (can be given to show_hide_button_list())
+		- iterable: list of (key,value) tuples for the arguments of the CheckBoxGroup callback: [('checkbox',checkbox),('index_filter',index_filter),('source',source)]
+
+	The rows of group k are the rows offsets[k] to offsets[k+1] of the source, so the callback only goes over the checked groups and the rows to show
+	'''
+	groups = group_by(table,keys)
+
+	order = np.concatenate(list(groups.values()))
+	offsets = np.cumsum([0]+[len(rows) for rows in groups.values()])
+
+	data = {name:table[name][order] for name in table}
+	data['group'] = np.repeat(np.arange(len(groups)),np.diff(offsets))
+
+	source = ColumnDataSource(data=data)
+
+	checkbox = CheckboxGroup(labels=[separator.join([str(key) for key in group]) for group in groups],active=list(range(len(groups))),height=height)
+
+	index_filter = IndexFilter(indices=list(range(len(order))))
+
+	checkbox_code = """
+	var offsets = %s;
+	var active = checkbox.active.slice().sort(function(a,b){return a-b});
+	var indices = [];
+	for (var a=0;a<active.length;a++){
+		for (var r=offsets[active[a]];r<offsets[active[a]+1];r++){indices.push(r)};
+	};
+	index_filter.indices = indices;
+	source.change.emit();
+	""" % str(offsets.tolist())
+
+	iterable = [('checkbox',checkbox),('index_filter',index_filter),('source',source)]
+
+	return source,checkbox,index_filter,checkbox_code,iterable
+
 def dumfig(width=600,height=600,legend={}):
 	'''
 	Need to make a dummy figure to get the legend somewhere by itself ....
@@ -96,15 +212,44 @@ def show_hide_button(in_lab,checkbox_name,checkbox_code,iterable,width=100):
 		- iterable : list of (key,value) tuples for the arguments of the button callback, the checkbox group must be one of them
 	Output:
 		- button that check/uncheck checkboxes with 'in_lab' in their label
+
+	The indices of the checkboxes with 'in_lab' in their label are found once in python, a click merges them with the sorted active checkboxes (union or difference) in one pass
 	'''
 
 	button = Button(label='Hide %s' % in_lab,width = width,button_type='danger',name=in_lab) # button to check/uncheck all boxes with 'prof'
 
-	button_success_code = """new_active = %s.active.slice(); for (i=0;i<%s.labels.length;i++) {if (%s.labels[i].includes('%s') && !(new_active.includes(i))) {new_active.push(i)}};new_active.sort();%s.active = new_active.slice();""" % (checkbox_name,checkbox_name,checkbox_name,in_lab,checkbox_name) + checkbox_code
-
-	button_danger_code = """new_active = %s.active.slice(); for (i=0;i<%s.labels.length;i++) {if (%s.labels[i].includes('%s') && %s.active.includes(i)) {new_active.splice(new_active.indexOf(i),1)}};%s.active = new_active.slice();""" % (checkbox_name,checkbox_name,checkbox_name,in_lab,checkbox_name,checkbox_name) + checkbox_code
+	indices = [i for i,label in enumerate(dict(iterable)[checkbox_name].labels) if in_lab in label]
+
+	button_start_code = """
+	var indices = %s;
+	var active = %s.active.slice().sort(function(a,b){return a-b});
+	var new_active = [];
+	var a = 0;
+	var b = 0;
+	""" % (str(indices),checkbox_name)
+
+	# union of the sorted active checkboxes and indices
+	button_success_code = """
+	while (a<active.length || b<indices.length) {
+		if (b==indices.length || (a<active.length && active[a]<indices[b])) {new_active.push(active[a]);a++;}
+		else if (a==active.length || indices[b]<active[a]) {new_active.push(indices[b]);b++;}
+		else {new_active.push(active[a]);a++;b++;}
+	};
+	%s.active = new_active;
+	""" % checkbox_name + checkbox_code
+
+	# difference of the sorted active checkboxes and indices
+	button_danger_code = """
+	while (a<active.length) {
+		if (b<indices.length && indices[b]<active[a]) {b++;}
+		else if (b<indices.length && indices[b]==active[a]) {a++;b++;}
+		else {new_active.push(active[a]);a++;}
+	};
+	%s.active = new_active;
+	""" % checkbox_name + checkbox_code
 
-	button_code = """if (cb_obj.button_type.includes("danger")){""" \
+	button_code = button_start_code \
+				+ """if (cb_obj.button_type.includes("danger")){""" \
 				+ button_danger_code\
 				+ """cb_obj.button_type = "success";cb_obj.label = "Show %s";} else {""" % in_lab \
 				+ button_success_code \
@@ -114,58 +259,77 @@ def show_hide_button(in_lab,checkbox_name,checkbox_code,iterable,width=100):
 
 	return button
 
+def keyword_codes(labels,keyword_dict,separator='-'):
+	"""
+	Return the keyword code table of a list of checkbox labels
+
+	- labels: the labels of a CheckBoxGroup
+	- keyword_dict: an OrderedDict of groups of keywords {key1:['abc','def','ghi',...],key2:['ab','cd',...],...}
+	- separator: the string between the keywords in the labels
+
+	Output: a list with one code per label and per group: codes[j*len(keyword_dict)+g] is the position of the keyword of group g in label j, or -1 if the label has no keyword of that group
+	a keyword is first looked for in the parts of the label split with separator, then anywhere in the label
+	"""
+	positions = [] # for each group, {keyword:position of the keyword in all the groups}
+	it = 0
+	for key in keyword_dict:
+		positions.append( collections.OrderedDict() )
+		for keyword in keyword_dict[key]:
+			positions[-1][keyword] = it
+			it += 1
+
+	codes = []
+	for label in labels:
+		parts = label.split(separator)
+		for group in positions:
+			code = -1
+			for part in parts:
+				if part in group:
+					code = group[part]
+					break
+			if code == -1:
+				for keyword in group:
+					if keyword in label:
+						code = group[keyword]
+						break
+			codes.append(code)
+
+	return codes
+
 def show_hide_button_list(keyword_dict,checkbox_code,iterable,width=100,separator='-'):
 	"""
 	Return a number of button that check / uncheck boxes in a CheckBoxGroup based on a keyword list and the CheckBoxGroup labels
 
-	- keyword_dict: an OrderedDict of groups of keywords, each group has keyword of a specific length {key1:['abc','def','ghi',...],key2:['ab','cd',...],...}
+	- keyword_dict: an OrderedDict of groups of keywords {key1:['abc','def','ghi',...],key2:['ab','cd',...],...}, there can be any number of groups
 	- checkbox_code: callback code of the CheckBoxGroup
 	- iterable: list of (key,value) tuples for the arguments of the CheckBoxGroup callback, must include the CheckBoxGroup itself as ('checkbox',CheckBoxGroup)
 	- width: width of the buttons
+	- separator: the string between the keywords in the checkbox labels
 
 	Output:
 		- buttons that check/uncheck checkboxes in a CheckBoxGroup if they include a certain keyword in their label
 		- button to uncheck all the checkboxes and switch all buttons to "show"
 		- button to check all the checkboxes and switch all buttons to "hide"
+
+	A checkbox is checked when the keyword of each group in its label has its button in the "hide" state
+	The keywords of each label are found once in python (see keyword_codes()), so a click only goes once over the labels
 	"""
 
+	checkbox = dict(iterable)['checkbox']
+
 	# create a button for each keyword in keyword_dict
 	button_list = []
-	for keyword in list(flatten(keyword_dict)):
+	for keyword in [keyword for key in keyword_dict for keyword in keyword_dict[key]]:
 		button_list.append( Button(label='Hide '+keyword,name=keyword,button_type='danger',width=width) )
 
 	clear_button = Button(label='Clear all',width=width) # button to uncheck all checkboxes
 	check_button = Button(label='Check all',width=width) # button to check all checkboxes
 
 	# adds the buttons to the iterable list for the callback arguments
-	new_iterable = iterable + [('button_'+button.name,button) for button in button_list]
-
-	# a string of the form '[button_a,button_b,...]' for the callback codes 
-	button_str = str(['button_'+button.name for button in button_list]).replace("'","")
-
-
-	button_key_code = "" # code that goes over each keyword group and button status to reconstruct the label of checkboxes to be checked / unchecked
-	show_full_code = "show_full = [];" # the array of labels with associated checkboxes that need to be checked
-	show_full = []
-	it = 0
-	loopid = ['i','j','k','l','m','n','o','p','q','r','s','t']
-	for key in keyword_dict: # loop to generate the code based on the number of keyword groups
-		button_key_code += '''
-		show_%s = [];
-		for (i=0;i<show_name.length;i++){
-		if(show_name[i].length==%s){show_%s.push(show_name[i])};
-		};
-		''' % (key,str(len(keyword_dict[key][0])),key)
-
-		show_full_code += "for(%s=0;%s<show_%s.length;%s++){" % (loopid[it],loopid[it],key,loopid[it])
-
-		show_full.append( 'show_%s[%s]' % (key,loopid[it]) )
+	new_iterable = iterable + [('button_'+str(it),button) for it,button in enumerate(button_list)]
 
-		it+=1 
-
-	show_full_code += "show_full.push("+("+'"+separator+"'+").join(show_full)+")"+"};"*it
-
-	button_key_code += show_full_code
+	# a string of the form '[button_0,button_1,...]' for the callback codes
+	button_str = '['+','.join(['button_'+str(it) for it in range(len(button_list))])+']'
 
 	# initial code for the buttons
 	button_switch_code = """
@@ -201,25 +365,24 @@ def show_hide_button_list(keyword_dict,checkbox_code,iterable,width=100,separato
 	"""
 
 	button_code = button_switch_code+"""
-	show_name = [];
-
-	for(i=0;i<button_list.length;i++) {
-		if(button_list[i].button_type.includes("danger")) {show_name.push(button_list[i].name)};
-	};
+	var codes = %s;
+	var ngroups = %s;
 
-	"""+button_key_code+"""
+	var shown = [];
+	for (i=0;i<button_list.length;i++) {shown.push(button_list[i].button_type.includes("danger"))};
 
 	new_active = [];
-
-	for (i=0;i<show_full.length;i++){
-		for(j=0;j<checkbox.labels.length;j++){
-		if (checkbox.labels[j].includes(show_full[i])) {new_active.push(j);};
+	for (j=0;j<checkbox.labels.length;j++){
+		var show = true;
+		for (var g=0;g<ngroups;g++){
+			var code = codes[j*ngroups+g];
+			if (code<0 || !shown[code]) {show = false;break;};
 		};
+		if (show) {new_active.push(j)};
 	};
-	new_active.sort();
-	checkbox.active = new_active.slice();
+	checkbox.active = new_active;
 
-	"""+checkbox_code
+	""" % (str(keyword_codes(checkbox.labels,keyword_dict,separator)),len(keyword_dict)) + checkbox_code
 
 	for button in button_list:
 		button.callback = CustomJS(args={key:value for key,value in new_iterable}, code=button_code)
@@ -248,17 +411,29 @@ if __name__ == "__main__":
 
 	fig = figure(tools=TOOLS)
 
-	for date in column:
-		for window in column[date]:
-			for mod in column[date][window]:
-				source = ColumnDataSource(data={'x':np.array([asza[date][window][spec_ID] for spec_ID in asza[date][window]]),'y':np.array([column[date][window][mod][spec_ID] for spec_ID in column[date][window][mod]]),'specID':[i for i in column[date][window][mod]],'date':['-'.join([date[:4],date[4:6],date[6:8]]) for i in column[date][window][mod]] })
-				if mod=='scl':
-					fig.scatter(x='x',y='y',color=color_dict[window],marker="triangle",name='-'.join([date,window,mod]),source=source)
-				else:
-					fig.scatter(x='x',y='y',color=color_dict[window],name='-'.join([date,window,mod]),source=source)
+	# flat tables of the nested dictionaries
+	column_table = flat_table(column,names=['date','window','mod','specID'],value='y')
+	sza_table = flat_table(asza,names=['date','window','specID'],value='x')
+
+	# add the SZA of each spectrum, the color of each window, and the formatted date to the table of columns
+	sza_rows = group_by(sza_table,['date','window'])
+	column_rows = group_by(column_table,['date','window','mod'])
+	column_table['x'] = np.zeros(len(column_table['y']))
+	for (date,window,mod),rows in column_rows.items():
+		column_table['x'][rows] = sza_table['x'][sza_rows[(date,window)]]
+	column_table['color'] = np.array([color_dict[window] for window in column_table['window']])
+	column_table['date_str'] = np.array(['-'.join([date[:4],date[4:6],date[6:8]]) for date in column_table['date']])
+
+	# all the points are in one source, the checkboxes show/hide groups of rows
+	source,checkbox,index_filter,checkbox_code,iterable = filtered_source(column_table,['date','window','mod'])
+
+	# one renderer per marker, whatever the number of dates
+	for mod,marker in [('prf','circle'),('scl','triangle')]:
+		view = CDSView(source=source,filters=[GroupFilter(column_name='mod',group=mod),index_filter])
+		fig.scatter(x='x',y='y',color='color',marker=marker,name=mod,source=source,view=view)
 
 	fig.select_one(HoverTool).tooltips = [
-		('date','@date'),
+		('date','@date_str'),
 		('spectrum #', '@specID'),
 	    ('SZA','@x'),
 	]
@@ -274,16 +449,6 @@ if __name__ == "__main__":
 
 	dumfig = dumfig(height=250,width=100,legend=dumleg)
 
-	# CheckboxGroup
-	rend_list = [rend for rend in fig.renderers if type(rend)==bokeh.models.renderers.GlyphRenderer]
-	checkbox = CheckboxGroup(labels=[rend.name for rend in rend_list],active=list(range(len(rend_list))),height=400)
-
-	# each scatter glyph is associated with a name, the CheckboxGroup too
-	iterable = [('p'+str(rend_list.index(rend)),rend) for rend in rend_list]+[('checkbox',checkbox)]
-
-	# code to trigger glyph visibility with checkboxes
-	checkbox_code = ''.join(['p'+str(rend_list.index(rend))+'.visible=checkbox.active.includes('+str(rend_list.index(rend))+');' for rend in rend_list])
-
 	# CheckboxGroup callback
 	checkbox.callback = CustomJS(args={key:value for key,value in iterable}, code=checkbox_code)
 
@@ -14,7 +14,7 @@ from __future__ import print_function # allows the use of Python 3.x print(funct
 '''
 This is an attempt to make a generic function to produce analysis plots for time series.
 
-# the function freq_match(DATA,select,FREQ,date_range=[None,None],save='') returns a dictionary
+# the function freq_match(DATA,select,FREQ,date_range=[None,None],save='',workers=None,cache_dir='',state='',watermark=None,stats=[],err='err',trim=0.1,profile=None) returns a dictionary
 
 	- DATA is a dictionary of the form
 	{ 
@@ -22,19 +22,61 @@ This is an attempt to make a generic function to produce analysis plots for time
 		'label1': {'x':[...],'y':[...]},
 		etc ...
 	}
-	with each 'label' associated with x (datetime) and y values
+	with each 'label' associated with x (datetime objects or numpy.datetime64) and y values
 
 	- select is one of the labels, all other 'label' data will be filtered to only keep coincident data.
 	- date_range[0] is the starting date for the matching & averaging YYYY-MM-DD-HH (e.g. 2010-01-02-14 for 2 PM January 2nd 2010, -HH is optional)
 	- date_range[1] is the end date for the matching & averaging
 	- FREQ is the frequency of data matching & averaging, date_range will be divided in intervals of FREQ 
 		- FREQ must be of the form '1 hours' or '2.3 days' or '7.21 weeks', put an 's' even for 1
-		- Matching and averaging can be very time consuming for the smaller frequencies
 	- save is the full path to where the FREQly matched and averaged data will be saved, if not specified the data will not be saved.
+	- workers is the number of processes used to match the labels in parallel, if not specified the labels are matched one after the other.
+	- cache_dir is the full path to a directory where the results are cached, keyed by a hash of the inputs; if the same inputs were already matched the result is loaded from the cache instead of being recomputed (with "state", the previous state is part of the key and the new state is also saved on a cache hit).
+	- state is the full path to a directory where the sums of data in each interval of FREQ are saved at the end of the run.
+		- if it already exists, the previous sums are used: only the intervals at or after 'watermark' are binned again and merged with them, and the intervals start from the previous date_range[0]
+		- this way DATA only needs to contain the new data (and any data in the interval of the watermark), the cost of an update is proportional to the new data and not the whole archive
+		- the x data must be sorted in time
+	- watermark is a datetime object, if not specified each label is binned again from its last interval with data in 'state'
+	- stats is a list of other statistics computed in each interval in addition to the mean, from bin_stat_names: 'count','median','trim_mean','std','wmean'
+		- they are added as extra columns next to 'x' and 'y' (see bin_stats()), and shown in the hover tool of bok_comp()
+		- err is the name of the column of DATA with the uncertainty of each value, used for the error-weighted mean 'wmean'
+		- trim is the fraction of the data removed on each side of the interval for the trimmed mean 'trim_mean'
+		- they can't be used with 'state' since they need all the data of each interval
+	- profile is a Profile object, the time spent in the stages 'cache', 'binning', 'matching' (for each label), 'statistics' and 'save' is added to it
 
-	- a dictionary is returned, it can directly be used in the function bok_comp()
+	- a dictionary is returned, it can directly be used in the function bok_comp(), the times 'x' are numpy.datetime64[ms]
 
-# The function bok_comp(DATA,select,xlab='',ylab='',sup_title='',notes='',prec='2') returns a bokeh gridplot object:
+# the function freq_match_stream(blocks,select,FREQ,date_range,save='') returns the same dictionary as freq_match()
+
+	- blocks is an iterable of (label,x,y) tuples with chunks of the data of each label (e.g. read from netCDF files with netcdf_blocks())
+	- only the sums of data in each interval of FREQ are kept in memory, use it for time series that do not fit in memory
+
+# the function tolerance_match(DATA,select,tolerance,date_range=[None,None],average=False,save='') returns the same dictionary as freq_match()
+
+	- instead of intervals of FREQ, each 'select' data is paired with the closest label data within +/- tolerance (e.g. '30 minutes'), or with the average of all of them if average=True
+	- data a few minutes apart on each side of an interval boundary are matched, so short tolerances can be used without losing coincidences
+
+# IntervalIndex(x,t0,time_step,span) is the index of the data of one label in the intervals of FREQ, in compressed sparse row layout
+
+	- index.samples(k) returns the indices of the data in interval k, index.sums(values) and index.means(values) sum or average any column in each interval
+	- it is made with one sort and can be given to bin_sums() and bin_stats() to reuse it
+
+# the function freq_bin(DATA,FREQ,date_range=[None,None]) bins the data of every label once in the same intervals of FREQ
+
+	- all the pairs of labels can then be compared without binning again: pair_data(BIN_DATA,label,ref) returns the dictionary of freq_match() for one pair, pair_stats(BIN_DATA) the statistics of all the pairs
+	- bok_matrix(BIN_DATA,xlab='',ylab='',sup_title='',notes='',prec='2') returns a bokeh gridplot object with a matrix of the Bias/RMS/R of all the pairs, clicking an element shows the time series and correlation plot of the pair
+
+# the function save_columns(DATA,path) saves a dictionary of columns (DATA, FREQ_DATA etc.) without pickling, load_columns(path) loads it
+
+	- the times are saved as int64 microseconds and the values as float64 in .npy files with a JSON manifest, in a directory that is memory-mapped when loading, or in a single .npz file if path ends with '.npz'
+	- convert_npy(npy_path,path) converts the pickled .npy sample files once, e.g. convert_npy('pressure_sample_data.npy','pressure_sample_data')
+
+# the function filter_data(DATA,ranges={},flags={},nan=['y']) returns a copy of DATA where each label only keeps the data satisfying all the conditions
+
+	- ranges is a dictionary {column:(low,high)} of bounds, flags is a dictionary {column:accepted values}, nan is a list of columns where NaNs are rejected
+	- the conditions are evaluated as numpy boolean masks, use it to prune all the labels before freq_match()
+
+# The function bok_comp(DATA,select,xlab='',ylab='',sup_title='',notes='',prec='2',server=False,max_cor_points=5000,lod=False,lod_points=2000,profile=None,density_points=0) returns a bokeh gridplot object:
 
 If you have data 'select' to which you want to compare several datasets 'lab0', 'lab1', etc.
 the DICTIONARY (or OrderedDict) DATA must be of the form:
@@ -71,11 +113,26 @@ The data in the table will also be updated based on the data selected within the
 	- 'sup_title' is the header of the html page
 	- 'notes' is a string of html code that will be displayed in a text widget beside the plots
 	- 'prec' is a "number string" that sets the precision of the values displayed in the table
+	- 'server' if True, the statistics of the BoxSelect selection are computed in python, to be used in a bokeh server app: curdoc().add_root(bok_comp(...,server=True))
+	- 'max_cor_points' with server=True, the selected data is downsampled to at most that number of points in the correlation figure
+	- 'lod' if True, the time series are displayed with a level of detail that depends on the zoom (see lod_display()), the statistics of the BoxSelect selection still use the full resolution data
+	- 'lod_points' with lod=True, the maximum number of points displayed per time series
+	- 'density_points' if > 0, when more than density_points data of a label are selected its correlation plot shows the density of points in a grid instead of each point
 
-# the function write_html(bok_obj,tab='bokeh',save='default.html') will create the html plot:
+# The function bok_series(DATA,xlab='',ylab='',sup_title='',notes='',lod=False,lod_points=2000,active=None,sidecar='',sidecar_url='',server=False) returns a bokeh gridplot object with a figure of all the time series of DATA {'label':{'x':[...],'y':[...]},...}:
+	- 'active' is the list of labels checked when the page opens, with 'sidecar' the data of the other labels is written in binary files in the 'sidecar' directory and only fetched by the page when they are checked (with server=True it is sent by the bokeh server instead)
+
+# the function write_html(bok_obj,tab='bokeh',save='default.html',binary=False,compress=False,profile=None) will create the html plot:
 	- "save" is the full path to the html file
 	- "tab" is the string that will appear in the browser tab when oppening the html file
 	- bok_obj is any bokeh object (figure,gridplot,tabs etc.)
+	- "binary" if True, the numeric data is embedded once as base64 typed arrays instead of JSON lists, and the byte budget of each data source is printed
+	- "compress" if True with binary=True, the typed arrays are also zlib-compressed
+	- "profile" is a Profile object, the time spent in each stage is added to it
+
+# Profile(memory=False) collects the time (and peak memory if memory=True) spent in the stages of freq_match(), bok_comp() and write_html()
+
+	- give the same Profile object to their 'profile' keyword, and use profile.save('profile.json') to write a JSON report with each stage (and label) and the total time per stage
 '''
 
 #############
@@ -85,10 +142,15 @@ The data in the table will also be updated based on the data selected within the
 # general
 import os
 import sys
+import shutil
+import tempfile
+import json
+import hashlib
 
 # time handling
 import time
 import calendar
+from contextlib import contextmanager
 from datetime import datetime,timedelta
 
 # special arrays with special functions
@@ -99,13 +161,19 @@ from math import ceil
 
 # interactive plots
 from bokeh.plotting import figure
-from bokeh.models import Legend, CustomJS, ColumnDataSource, CheckboxGroup, Button, Div, HoverTool
+from bokeh.models import Legend, CustomJS, ColumnDataSource, CheckboxGroup, Button, Div, HoverTool, LinearColorMapper, ColorBar
+from bokeh.models.widgets import Panel, Tabs
+from bokeh.palettes import RdBu11, Viridis256
 from bokeh.models.widgets import DataTable, TableColumn
 from bokeh.layouts import gridplot, widgetbox
 from bokeh.resources import CDN
 from bokeh.embed import file_html
 
+# html files with binary data, shared with heatmap.py
+from binary_html import binary_columns, binary_file_html, print_report
+
 from collections import OrderedDict
+
 #########
 # Setup #
 #########
@@ -159,31 +227,434 @@ def progress(i,tot,bar_length=20,char=''):
 ###############################################################################################################################
 ###############################################################################################################################
 
-def filter(DATA,limit,condition=''):
+class Profile(object):
+	"""
+	timer of the stages of freq_match(), bok_comp() and write_html(), give the same Profile object to their 'profile' keyword to collect the time spent in each stage
+
+	- memory: if True the peak memory allocated by python during each stage is also measured with tracemalloc (python 3 only), this slows down the code
+
+	profile = Profile()
+	FREQ_DATA = freq_match(DATA,select,FREQ,profile=profile)
+	write_html(bok_comp(FREQ_DATA,select,profile=profile),profile=profile)
+	profile.save('profile.json')
+	"""
+	def __init__(self,memory=False):
+		self.memory = memory
+		self.stages = [] # one dictionary per stage {'stage':name,'label':label or None,'seconds':time spent,'peak_memory':bytes or None}
+		self.running = [] # peak memory of the stages being timed, a stage contains the stages started inside it
+
+		if self.memory:
+			try:
+				import tracemalloc
+			except ImportError:
+				print('tracemalloc is not available, the memory will not be measured')
+				self.memory = False
+
+	@contextmanager
+	def stage(self,name,label=None):
+		"""
+		context manager timing the code in the 'with' block as stage 'name', of data 'label' if the stage is done for each label
+		"""
+		if self.memory:
+			import tracemalloc
+			if not tracemalloc.is_tracing():
+				tracemalloc.start()
+			if self.running: # the peak of the enclosing stage so far is kept before it is reset
+				self.running[-1] = max(self.running[-1],tracemalloc.get_traced_memory()[1])
+			if hasattr(tracemalloc,'reset_peak'):
+				tracemalloc.reset_peak()
+			self.running.append(0)
+
+		milestone = time.time()
+		try:
+			yield
+		finally:
+			seconds = time.time()-milestone
+			peak = None
+			if self.memory:
+				peak = max(tracemalloc.get_traced_memory()[1],self.running.pop())
+				if self.running:
+					self.running[-1] = max(self.running[-1],peak)
+			self.stages.append({'stage':name,'label':label,'seconds':seconds,'peak_memory':peak})
+
+	def add(self,name,seconds,label=None):
+		"""
+		add a stage timed elsewhere (e.g. in a worker process)
+		"""
+		self.stages.append({'stage':name,'label':label,'seconds':seconds,'peak_memory':None})
+
+	def report(self):
+		"""
+		returns a dictionary with the list of 'stages' in the order they finished, and the 'total' time spent in each stage name
+		"""
+		total = OrderedDict()
+		for stage in self.stages:
+			total[stage['stage']] = total.get(stage['stage'],0)+stage['seconds']
+
+		return {'stages':self.stages,'total':total}
+
+	def save(self,path):
+		"""
+		write the report() in a JSON file at 'path'
+		"""
+		with open(path,'w') as outfile:
+			json.dump(self.report(),outfile,indent=1)
+
+@contextmanager
+def no_stage():
+	"""
+	context manager that does nothing, used when no Profile is given
+	"""
+	yield
+
+def profile_stage(profile,name,label=None):
+	"""
+	returns profile.stage(name,label), or a context manager that does nothing if profile is None
+	"""
+	if profile is None:
+		return no_stage()
+
+	return profile.stage(name,label)
+
+###############################################################################################################################
+###############################################################################################################################
+
+def filter_ids(DATA,limit,condition=''):
 	"""
 	DATA must be a list or numpy.array
 	return a list of indices from DATA satisfying indices = [i for i in range(len(DATA)) if DATA[i] condition limit]
+	this function was called filter(), it was renamed so that it does not shadow the builtin filter
+	"""
+	operators = {'>':np.greater,'>=':np.greater_equal,'<':np.less,'<=':np.less_equal,'==':np.equal}
+
+	return np.flatnonzero(operators[condition](np.asarray(DATA),limit)).tolist()
+
+def data_mask(data,ranges={},flags={},nan=['y']):
+	"""
+	- data is a dictionary of columns of the same length {'x':[...],'y':[...],'flag':[...],...} for one label
+	- ranges is a dictionary {column:(low,high)} to only keep data with low <= data[column] <= high, low or high can be None for no bound (e.g. {'x':(datetime(2015,1,1),None),'y':(0,1000)})
+	- flags is a dictionary {column:value or list of values} to only keep data with data[column] equal to one of the values (e.g. {'flag':0})
+	- nan is a list of columns in which NaN values are rejected
+
+	returns a boolean numpy.array that is True for the data satisfying all the conditions
 	"""
+	mask = np.ones(len(data['x']),dtype=bool)
 
-	if condition == '>':
-		filter_IDs = [i for i in range(len(DATA)) if DATA[i]>limit]
-	if condition == '>=':
-		filter_IDs = [i for i in range(len(DATA)) if DATA[i]>=limit]
-	if condition == '<':
-		filter_IDs = [i for i in range(len(DATA)) if DATA[i]<limit]
-	if condition == '<=':
-		filter_IDs = [i for i in range(len(DATA)) if DATA[i]<=limit]
-	if condition == '==':
-		filter_IDs = [i for i in range(len(DATA)) if DATA[i]==limit]
+	for column in ranges:
+		low,high = ranges[column]
+		if column == 'x': # compare times as numpy.datetime64 whatever the type of the dates and bounds
+			values = as_datetime64(data[column])
+			low,high = [bound if bound is None else as_datetime64(bound) for bound in (low,high)]
+		else:
+			values = np.asarray(data[column])
+		if low is not None:
+			mask &= values >= low
+		if high is not None:
+			mask &= values <= high
 
-	return filter_IDs
+	for column in flags:
+		mask &= np.isin(np.asarray(data[column]),flags[column])
 
+	for column in nan:
+		mask &= ~np.isnan(np.asarray(data[column],dtype=np.float64))
+
+	return mask
+
+def filter_data(DATA,ranges={},flags={},nan=['y']):
+	"""
+	- DATA is a dictionary of the form given to freq_match() or bok_series() {'label':{'x':[...],'y':[...],...},...}
+	- ranges, flags and nan are the conditions of data_mask(), columns missing for a label are ignored for that label
+
+	returns a new dictionary with the same labels, where all the columns of each label only keep the data satisfying all the conditions
+	use it to prune all the labels before freq_match()
+	"""
+	FILTERED_DATA = OrderedDict()
+	for label in DATA:
+		mask = data_mask(
+							DATA[label],
+							ranges={column:ranges[column] for column in ranges if column in DATA[label]},
+							flags={column:flags[column] for column in flags if column in DATA[label]},
+							nan=[column for column in nan if column in DATA[label]],
+							)
+
+		FILTERED_DATA[label] = {}
+		for key in DATA[label]:
+			if key == 'color':
+				FILTERED_DATA[label][key] = DATA[label][key]
+			else:
+				FILTERED_DATA[label][key] = np.asarray(DATA[label][key])[mask]
+
+	return FILTERED_DATA
+
+###############################################################################################################################
+###############################################################################################################################
+
+def selection_prefix_sums(y1,y2):
+	"""
+	- y1 and y2 are numpy.arrays of coincident values (e.g. 'label' and 'select' data)
+
+	returns (prefix,terms) for selection_stats():
+		- terms is a dictionary of the per-element terms of the sums (d, d2, y1, y2, y1y1, y2y2, y1y2)
+		- prefix is a dictionary of their cumulative sums, each array starts with 0 so that the sum of the elements i to j-1 is prefix[key][j]-prefix[key][i]
+	the data is shifted by its mean before the sums to avoid losing precision in the sums of squares
+	"""
+	y1 = np.asarray(y1,dtype=np.float64)
+	y2 = np.asarray(y2,dtype=np.float64)
+
+	shift = (y1.mean()+y2.mean())/2 if len(y1) else 0.0
+	y1 = y1-shift
+	y2 = y2-shift
+
+	terms = {'d':y1-y2,'d2':(y1-y2)**2,'y1':y1,'y2':y2,'y1y1':y1*y1,'y2y2':y2*y2,'y1y2':y1*y2}
+
+	prefix = {key:np.concatenate(([0.0],np.cumsum(terms[key]))) for key in terms}
+
+	return prefix,terms
+
+def selection_stats(prefix,terms,inds):
+	"""
+	- prefix and terms are the dictionaries returned by selection_prefix_sums(y1,y2)
+	- inds is a numpy.array of unique selected indices
+
+	returns (N,RMS,Bias,Scatter,R) for the differences y1-y2 of the selected data, as computed in the javascript callback of bok_comp()
+	a contiguous selection (e.g. a time range selected with the BoxSelect tool) only costs two lookups per sum, other selections only sum the selected terms
+	"""
+	N = len(inds)
+	if N == 0:
+		return 0,0,0,0,0
+
+	first = inds.min()
+	last = inds.max()
+	if last-first+1 == N:
+		sums = {key:prefix[key][last+1]-prefix[key][first] for key in prefix}
+	else:
+		sums = {key:terms[key][inds].sum() for key in terms}
+
+	bias = sums['d']/N
+	ym1 = sums['y1']/N
+	ym2 = sums['y2']/N
+
+	with np.errstate(divide='ignore',invalid='ignore'):
+		rms = np.sqrt(sums['d2']/N)
+		scatter = np.sqrt(max(sums['d2']-N*bias**2,0)/(N-1)) if N > 1 else np.nan
+		T1 = sums['y1y2']-N*ym1*ym2
+		T2 = sums['y1y1']-N*ym1**2
+		T3 = sums['y2y2']-N*ym2**2
+		R = T1/np.sqrt(T2*T3)
+
+	return N,rms,bias,scatter,R
+
+def selection_callback(y1,y2,row,table_source,cor_source,prec='2',max_cor_points=5000):
+	"""
+	returns a python callback for the 'selected' property of a ColumnDataSource of 'label' data in bok_comp(...,server=True)
+
+	- y1 and y2 are the 'label' and coincident 'select' values
+	- row is the row of the label in the table
+	- table_source is the ColumnDataSource of the table
+	- cor_source is the ColumnDataSource of the label in the correlation figure, it is filled with at most max_cor_points evenly spaced selected points
+	- prec is a "number string" that sets the precision of the values displayed in the table
+	"""
+	y1 = np.asarray(y1,dtype=np.float64)
+	y2 = np.asarray(y2,dtype=np.float64)
+	prefix,terms = selection_prefix_sums(y1,y2)
+
+	def callback(attr,old,new):
+		inds = np.asarray(new['1d']['indices'],dtype=np.int64)
+
+		N,rms,bias,scatter,R = selection_stats(prefix,terms,inds)
+
+		table_source.patch({
+							'N':[(row,N)],
+							'RMS':[(row,'{:.{}f}'.format(rms,int(prec)))],
+							'Bias':[(row,'{:.{}f}'.format(bias,int(prec)))],
+							'Scatter':[(row,'{:.{}f}'.format(scatter,int(prec)))],
+							'R':[(row,'{:.{}f}'.format(R,int(prec)))],
+							})
+
+		if N > max_cor_points:
+			inds = np.sort(inds)[np.linspace(0,N-1,max_cor_points).astype(np.int64)]
+
+		cor_source.data = {'x':y2[inds],'y':y1[inds]}
+
+	return callback
+
+def lod_levels(y,lod_points=2000):
+	"""
+	- y is a numpy.array of values sorted in time
+	- lod_points is the maximum number of points of the coarsest level
+
+	returns a list of sorted index arrays of decimated levels, from the finest to the coarsest
+	each level keeps the first, last, minimum and maximum values of buckets of consecutive data (M4 decimation), so the shape of the time series is kept, and has buckets twice larger than the previous level
+	there are no levels if the data already has less than lod_points points
+	"""
+	y = np.asarray(y,dtype=np.float64)
+	N = len(y)
+
+	levels = []
+	points = N
+	bucket = 8 # the finest level has at most half the points of the full data
+	while (points > lod_points) and (bucket < 2*N):
+		n_buckets = int(ceil(N/float(bucket)))
+		starts = np.arange(n_buckets)*bucket
+
+		# pad the data to a whole number of buckets, NaNs and padding are never picked as minimum or maximum
+		padded = np.concatenate((y,np.full(n_buckets*bucket-N,np.nan))).reshape(n_buckets,bucket)
+		low = np.where(np.isnan(padded),np.inf,padded).argmin(axis=1)
+		high = np.where(np.isnan(padded),-np.inf,padded).argmax(axis=1)
+
+		ids = np.concatenate((starts,np.minimum(starts+bucket,N)-1,starts+low,starts+high))
+		levels.append(np.unique(ids[ids<N]))
+
+		points = len(levels[-1])
+		bucket *= 2
+
+	return levels
+
+# javascript function used in callbacks to find the first index of the sorted array x with x[i] >= value
+bisect_js = """
+	function bisect(x,value) {
+		var low = 0;
+		var high = x.length;
+		while (low < high) {
+			var mid = Math.floor((low+high)/2);
+			if (x[mid] < value) {low = mid+1;} else {high = mid;}
+		}
+		return low;
+	}
+	"""
+
+def cor_fill_js(density_points=0,bins=50):
+	"""
+	returns a javascript function fill_cor(s1,s2,scor,sdens) used in the callbacks of bok_comp() to fill the correlation figure with the selected data of one label
+
+	- s1 and s2 are the sources of the 'label' and coincident 'select' data, scor and sdens the sources of the correlation points and density of the label
+	- the points are copied in two typed arrays allocated once per label with the size of its data, the source only gets views of their first elements
+	- if density_points > 0 and more than density_points data are selected, the number of points in each cell of a bins x bins grid is shown instead of the points, with an opacity proportional to the count
+	"""
+	return """
+	function fill_cor(s1,s2,scor,sdens) {
+		var inds = s1.selected['1d'].indices;
+		var n = inds.length;
+		var y1 = s1.data['y'];
+		var y2 = s2.data['y'];
+		var bins = """+str(bins)+""";
+		scor.stale = false;
+
+		if ((n > """+str(density_points)+""") && ("""+str(density_points)+""" > 0)) {
+			var low = Infinity;
+			var high = -Infinity;
+			for (var i=0; i<n; i++) {
+				low = Math.min(low,y1[inds[i]],y2[inds[i]]);
+				high = Math.max(high,y1[inds[i]],y2[inds[i]]);
+			}
+			var w = ((high-low) || 1)/bins;
+
+			var counts = new Float64Array(bins*bins);
+			for (var i=0; i<n; i++) {
+				var cx = Math.min(Math.floor((y2[inds[i]]-low)/w),bins-1);
+				var cy = Math.min(Math.floor((y1[inds[i]]-low)/w),bins-1);
+				counts[cy*bins+cx] += 1;
+			}
+
+			var cells = 0;
+			var max_count = 0;
+			for (var c=0; c<counts.length; c++) {
+				if (counts[c] > 0) {cells++; max_count = Math.max(max_count,counts[c]);}
+			}
+
+			var dx = new Float64Array(cells), dy = new Float64Array(cells), dw = new Float64Array(cells), alpha = new Float64Array(cells);
+			var k = 0;
+			for (var c=0; c<counts.length; c++) {
+				if (counts[c] > 0) {
+					dx[k] = low+(c%bins+0.5)*w;
+					dy[k] = low+(Math.floor(c/bins)+0.5)*w;
+					dw[k] = w;
+					alpha[k] = 0.1+0.9*counts[c]/max_count;
+					k++;
+				}
+			}
+
+			sdens.data = {'x':dx,'y':dy,'w':dw,'alpha':alpha};
+			scor.data = {'x':new Float64Array(0),'y':new Float64Array(0)};
+			return;
+		}
+
+		if (!(scor.cor_x instanceof Float64Array) || (scor.cor_x.length < y1.length)) {
+			scor.cor_x = new Float64Array(y1.length);
+			scor.cor_y = new Float64Array(y1.length);
+		}
+		for (var i=0; i<n; i++) {
+			scor.cor_x[i] = y2[inds[i]];
+			scor.cor_y[i] = y1[inds[i]];
+		}
+
+		scor.data = {'x':scor.cor_x.subarray(0,n),'y':scor.cor_y.subarray(0,n)};
+		if (sdens.data['x'].length) {sdens.data = {'x':[],'y':[],'w':[],'alpha':[]};}
+	}
+	"""
+
+def lod_display(fig,full_sources,lod_points=2000):
+	"""
+	level of detail for time series plotted in a figure with a datetime x axis
+
+	- fig is the figure
+	- full_sources is a list of ColumnDataSources with the full resolution data, 'x' (numpy.datetime64) must be sorted in time
+	- lod_points is the maximum number of points displayed per source
+
+	returns a list of ColumnDataSources to plot instead of full_sources
+	each one initially holds the coarsest level of lod_levels(), when the x range of the figure changes the finest level with at most lod_points points within the range is displayed
+	"""
+	args = {}
+	series = []
+	display_sources = []
+	for it,source in enumerate(full_sources):
+		levels = [source]
+		for ids in lod_levels(source.data['y'],lod_points):
+			levels.append( ColumnDataSource(data={key:np.asarray(source.data[key])[ids] for key in source.data}) )
+
+		display_sources.append( ColumnDataSource(data=dict(levels[-1].data)) )
+
+		args['display'+str(it)] = display_sources[-1]
+		level_names = []
+		for level in levels:
+			level_names.append('level'+str(it)+'_'+str(len(level_names)))
+			args[level_names[-1]] = level
+		series.append('[display'+str(it)+',['+','.join(level_names)+']]')
+
+	fig.x_range.callback = CustomJS(args=args,code=bisect_js+"""
+	var series = ["""+','.join(series)+"""];
+	var start = cb_obj.start;
+	var end = cb_obj.end;
+
+	for (var s=0; s<series.length; s++) {
+		var display = series[s][0];
+		var levels = series[s][1];
+
+		// finest level with at most lod_points points within the x range
+		for (var k=0; k<levels.length; k++) {
+			var x = levels[k].data['x'];
+			var i0 = bisect(x,start);
+			var i1 = bisect(x,end);
+			if ((i1-i0 <= """+str(lod_points)+""") || (k == levels.length-1)) {break;}
+		}
+
+		// keep one point on each side of the range so lines don't stop at the edges
+		i0 = Math.max(i0-1,0);
+		i1 = Math.min(i1+1,x.length);
+
+		var new_data = {};
+		for (var key in levels[k].data) {new_data[key] = levels[k].data[key].slice(i0,i1);}
+		display.data = new_data;
+	}
+	""")
+
+	return display_sources
 
 ###############################################################################################################################
 ###############################################################################################################################
 
 # make a plot to compare n arrays 
-def bok_comp(DATA,select,xlab='',ylab='',sup_title='',notes='',prec='2'):
+def bok_comp(DATA,select,xlab='',ylab='',sup_title='',notes='',prec='2',server=False,max_cor_points=5000,lod=False,lod_points=2000,profile=None,density_points=0):
 	"""
 	If you have data 'select' to which you want to compare several datasets 'lab0', 'lab1', etc.
 	the DICTIONARY (or OrderedDict) DATA must be of the form:
@@ -209,6 +680,7 @@ def bok_comp(DATA,select,xlab='',ylab='',sup_title='',notes='',prec='2'):
 
 	where 'select0', 'select1' etc are subsets of 'select' containing only data respectively coincident with 'lab0','lab1' etc.
 	if colors are not specified, the kelly_color dictionary will be used
+	the times 'x' can be datetime objects or numpy.datetime64, they are formatted by the browser in the hover tool
 
 	There will be two figures, one table, and one "notes" text widget.
 	The main figure will show all the time series of coincident data between each 'lab' and 'select'.
@@ -221,22 +693,19 @@ def bok_comp(DATA,select,xlab='',ylab='',sup_title='',notes='',prec='2'):
 		- 'sup_title' is the header of the html page
 		- 'notes' is a string of html code that will be displayed in a text widget beside the plots
 		- 'prec' is a "number string" that sets the precision of the values displayed in the table
+		- 'server' if True, the statistics of the BoxSelect selection are computed in python, to be used in a bokeh server app: curdoc().add_root(bok_comp(...,server=True))
+		- 'max_cor_points' with server=True, the selected data is downsampled to at most that number of points in the correlation figure
+		- 'lod' if True, the time series are displayed with a level of detail that depends on the zoom (see lod_display()), the statistics of the BoxSelect selection still use the full resolution data
+		- 'lod_points' with lod=True, the maximum number of points displayed per time series
+		- 'profile' is a Profile object, the time spent in the stages 'sources' (for each label) and 'layout' is added to it
+		- 'density_points' if > 0, when more than density_points data of a label are selected its correlation plot shows the density of points in a grid instead of each point
 	"""
 
-	######## /!\ important time handling to make sure times don't get shifted from UTC due to computer environment variables when using datetime objects ###########
-	os.environ['TZ'] = 'UTC'
-	time.tzset()
-	# This will not change your system timezone settings
-	################################################################################################################################################################
-
 	for label in DATA:
 		try:
 			test = DATA[label]['color']
 		except KeyError:
 			DATA[label]['color'] = kelly_colors[kelly_colors.keys()[DATA.keys().index(label)]]
-		for key in DATA[label]:
-			if key != 'color':
-				DATA[label][key]['nicetime'] = [dat.strftime('%d-%m-%Y %H:%M:%S') for dat in DATA[label][key]['x']]
 
 
 	if sup_title == '':
@@ -262,152 +731,422 @@ def bok_comp(DATA,select,xlab='',ylab='',sup_title='',notes='',prec='2'):
 
 	txt = Div(text='Display the table with increasing # before starting a new selection',width = 450) # text div that will be updated with the selected range of date within the BoxSelect tool
 
+	# callback shared by all 'label' data sources to update the correlation plot and the table based on the BoxSelect tool selection.
+	# the 'select' and correlation sources of a label are found by name, and its row in the table from the 'Name' column
+	# all the statistics are computed in a single pass over the selection with Welford's algorithm
+	# the correlation plot of a label is only filled if it is visible, otherwise it is filled by the checkbox callback when the label is checked again
+	selection_code = cor_fill_js(density_points) + """
+	var inds = cb_obj.selected['1d'].indices;
+	var n = inds.length;
+	var row = dt.source.data['Name'].indexOf(cb_obj.name);
+	var s2 = cb_obj.document.get_model_by_name(cb_obj.name+' select');
+	var scor = cb_obj.document.get_model_by_name(cb_obj.name+' cor');
+	var sdens = cb_obj.document.get_model_by_name(cb_obj.name+' density');
+	var corplot = cb_obj.document.get_model_by_name(cb_obj.name+' corplot');
+	var tab = dt.source.data;
+
+	// the values are converted to typed arrays only once
+	if (!(cb_obj.data['y'] instanceof Float64Array)) {cb_obj.data['y'] = Float64Array.from(cb_obj.data['y']);}
+	if (!(s2.data['y'] instanceof Float64Array)) {s2.data['y'] = Float64Array.from(s2.data['y']);}
+	var y1 = cb_obj.data['y'];
+	var y2 = s2.data['y'];
+
+	var md = 0, M2d = 0; // mean and sum of squared deviations of the differences
+	var m1 = 0, m2 = 0, M21 = 0, M22 = 0, C12 = 0; // means, sums of squared deviations and co-moment of y1 and y2
+
+	for (var i=0; i < n; i++){
+		var a = y1[inds[i]];
+		var b = y2[inds[i]];
+		var k = i+1;
+
+		var dd = a-b-md;
+		md += dd/k;
+		M2d += dd*(a-b-md);
+
+		var d1 = a-m1;
+		var d2 = b-m2;
+		m1 += d1/k;
+		m2 += d2/k;
+		M21 += d1*(a-m1);
+		M22 += d2*(b-m2);
+		C12 += d1*(b-m2);
+	}
+
+	tab['N'][row] = n;
+	if (n == 0) {
+		tab['RMS'][row] = 0;
+		tab['Bias'][row] = 0;
+		tab['Scatter'][row] = 0;
+		tab['R'][row] = 0;
+	} else {
+		tab['RMS'][row] = Math.sqrt(M2d/n+md*md).toFixed("""+prec+""");
+		tab['Bias'][row] = md.toFixed("""+prec+""");
+		tab['Scatter'][row] = Math.sqrt(M2d/(n-1)).toFixed("""+prec+""");
+		tab['R'][row] = (C12/Math.sqrt(M21*M22)).toFixed("""+prec+""");
+	}
+
+	dt.change.emit();
+
+	if (corplot.visible) {fill_cor(cb_obj,s2,scor,sdens);} else {scor.stale = true;}
+	"""
+	selection_callback_js = CustomJS(args=dict(dt=data_table),code=selection_code)
+
 	sources = {} # data sources for the main figure
 	cor_sources = {} # data sources for the correlation figure
+	dens_sources = {} # data sources for the density of points in the correlation figure
 	count = 0 # iterated in the for loop below and used in the sources callbacks
 	for label in DATA:
-		sources[label] = {} # for each source 'label', there will be two time series, the 'label' data, and the coincident 'select' data
-		sources[label][label] = ColumnDataSource(data=DATA[label][label]) # 'label' data
-		sources[label][select] = ColumnDataSource(data=DATA[label][select]) # 'select' data that is coincident with 'label' data
+		with profile_stage(profile,'sources',label):
+			sources[label] = {} # for each source 'label', there will be two time series, the 'label' data, and the coincident 'select' data
+			sources[label][label] = ColumnDataSource(data=datetime64_columns(DATA[label][label]),name=label) # 'label' data
+			sources[label][select] = ColumnDataSource(data=datetime64_columns(DATA[label][select]),name=label+' select') # 'select' data that is coincident with 'label' data
 
-		cor_sources[label] = ColumnDataSource(data={'x':[],'y':[]}) # fillable source for the correlation figure
+			cor_sources[label] = ColumnDataSource(data={'x':[],'y':[]},name=label+' cor') # fillable source for the correlation figure
+			dens_sources[label] = ColumnDataSource(data={'x':[],'y':[],'w':[],'alpha':[]},name=label+' density') # fillable source for the density in the correlation figure
 
-		# give a callback to all 'label' data sources to update the correlation plot and the table based on the BoxSelect tool selection.
-		sources[label][label].callback = CustomJS(args = dict(s2=sources[label][select],dt=data_table,scor=cor_sources[label]), code="""
-		var inds = cb_obj.selected['1d'].indices;
-		var d1 = cb_obj.data;
-		var d2 = s2.data;
-		var tab = dt.source.data;
-		var dcor = scor.data;
+			# give a callback to all 'label' data sources to update the correlation plot and the table based on the BoxSelect tool selection.
+			if server:
+				sources[label][label].on_change('selected',selection_callback(DATA[label][label]['y'],DATA[label][select]['y'],count,table_source,cor_sources[label],prec,max_cor_points))
+			else:
+				sources[label][label].callback = selection_callback_js
 
-		var difm = 0;
-		var difm2 = 0;
-		var scat = 0;
+		count+=1
 
-		var ym1 = 0;
-		var ym2 = 0;
+	with profile_stage(profile,'layout'): # the rest of the function builds the figures and widgets
 
-		var T1 = 0;
-		var T2 = 0;
-		var T3 = 0;
+		#get the min and max of all the data y
+		min_y = min([min(abs(DATA[label][label]['y'])) for label in DATA])
+		max_y = max([max(DATA[label][label]['y']) for label in DATA])
 
-		dcor['x'] = [];
-		dcor['y'] = [];
+		max_ampli = max_y - min_y
 
-		tab['N']["""+str(count)+"""] = inds.length;
+		# we will set the y axis range at +/- 10% of the data max amplitude
+		min_y = min_y - max_ampli*10/100
+		max_y = max_y + max_ampli*10/100
 
+		TOOLS = "pan,hover,wheel_zoom,box_zoom,undo,redo,reset,box_select,save" # interactive tools available in the html plot
 
-		if (inds.length == 0) {
-			tab['RMS']["""+str(count)+"""] = 0;
-			tab['Bias']["""+str(count)+"""] = 0;
-			tab['Scatter']["""+str(count)+"""] = 0;
-			tab['R']["""+str(count)+"""] = 0;
-			dt.change.emit();
-			return;
-		}
+		fig = figure(output_backend="webgl",plot_width=900,plot_height=200+20*(len(DATA.keys())-2),tools=TOOLS,x_axis_type='datetime', y_range=[min_y,max_y],toolbar_location='left') # figure with the time series
 
-		for (i=0; i < inds.length; i++){
-			difm += d1['y'][inds[i]] - d2['y'][inds[i]];
-			difm2 += Math.pow(d1['y'][inds[i]] - d2['y'][inds[i]],2);
-			ym1 += d1['y'][inds[i]];
-			ym2 += d2['y'][inds[i]];
+		fig.tools[-2].dimensions='width' # only allow the box select tool to select data along the X axis (will select all Y data in a given X range)
 
-			dcor['x'].push(d2['y'][inds[i]]);
-			dcor['y'].push(d1['y'][inds[i]]);
+		# make the BoxSelect tool update the 'txt' Div widget with the currently selected range of dates.
+		box_select_args = dict(txt=txt)
+		box_select_code = """
+			var sel = cb_data["geometry"];
+		
+			var startsec = sel["x0"]/1000;
+			var start = new Date(0);
+
+			start.setUTCSeconds(startsec)
+
+			var startstring = ("0" + start.getUTCDate()).slice(-2) + "-" + ("0"+(start.getUTCMonth()+1)).slice(-2) + "-" +start.getUTCFullYear() + " " + ("0" + start.getUTCHours()).slice(-2) + ":" + ("0" + start.getUTCMinutes()).slice(-2);
+
+			var finishsec = sel["x1"]/1000;
+			var finish = new Date(0);
+
+			finish.setUTCSeconds(finishsec)
+
+			var finishstring = ("0" + finish.getUTCDate()).slice(-2) + "-" + ("0"+(finish.getUTCMonth()+1)).slice(-2) + "-" +finish.getUTCFullYear() + " " + ("0" + finish.getUTCHours()).slice(-2) + ":" + ("0" + finish.getUTCMinutes()).slice(-2);
+
+			txt.text = 'Selection range from '+startstring + ' to ' + finishstring;
+
+			txt.trigger("change"); 
+			"""
+
+		# with lod=True the plotted sources are decimated, so the BoxSelect tool selects the same time range in the full resolution 'label' sources, which triggers their statistics callbacks
+		if lod:
+			full_names = []
+			for label in DATA:
+				full_names.append('full'+str(len(full_names)))
+				box_select_args[full_names[-1]] = sources[label][label]
+			box_select_code += bisect_js + """
+			var full_sources = ["""+','.join(full_names)+"""];
+			for (var s=0; s<full_sources.length; s++) {
+				var x = full_sources[s].data['x'];
+				var inds = [];
+				var last = bisect(x,sel["x1"]);
+				for (var i=bisect(x,sel["x0"]); i<last; i++) {inds.push(i);}
+				var selected = Object.assign({},full_sources[s].selected);
+				selected['1d'] = {indices:inds};
+				full_sources[s].selected = selected;
+			}
+			"""
+
+		fig.tools[-2].callback = CustomJS(args=box_select_args,code=box_select_code)
+
+		# actual time series
+		series_sources = []
+		for label in DATA:
+			series_sources += [sources[label][label],sources[label][select]]
+		if lod:
+			series_sources = lod_display(fig,series_sources,lod_points)
+
+		plots = []
+		for it,label in enumerate(DATA):
+			plots.append( fig.scatter(x='x',y='y',color=DATA[label]['color'],alpha=0.5,source=series_sources[2*it]) )
+			plots.append( fig.scatter(x='x',y='y',color='black',alpha=0.5,source=series_sources[2*it+1]) )
+
+		# hover tool configuration, the times are formatted by the browser
+		# the statistics added by freq_match(...,stats=[...]) are also shown
+		fig.select_one(HoverTool).tooltips = [
+			('index','$index'),
+		    ('y','@y'),
+		    ('x','@x{%d-%m-%Y %H:%M:%S}'),
+		]+[(column,'@'+column) for column in bin_stat_columns if all([column in DATA[label][label] for label in DATA])]
+		fig.select_one(HoverTool).formatters = {'x':'datetime'}
+
+		N_plots = range(len(plots)) # used in the checkbox callbacks
+
+		# used in the checkbox callbacks, we will trigger both 'label' and coincident 'select' data visibility at the same time
+		N_plots2 = range(len(plots)/2) 
+		even_plots = [i for i in N_plots if i%2 == 0]
+
+		# setup the legend and axis labels for the main figure
+		legend=Legend(items=[(select,[plots[1]])]+[(DATA.keys()[i],[plots[even_plots[i]]]) for i in range(len(DATA.keys()))],location=(0,0))
+		fig.add_layout(legend,'right')
+		fig.yaxis.axis_label = ylab
+		fig.xaxis.axis_label = xlab
+
+		# correlation figure
+		cor_fig = figure(output_backend="webgl",title = 'Correlations', plot_width = 250, plot_height = 280, x_range = [min_y,max_y], y_range = [min_y,max_y]) 
+		cor_fig.toolbar.logo = None
+		cor_fig.toolbar_location = None
+		cor_fig.xaxis.axis_label = ' '.join([select,ylab])
+		cor_fig.yaxis.axis_label = ylab
+
+		# one to one line in the correlation plot
+		linerange = list(np.arange(0,int(max_y),ceil(max_y)/10.0))+[max_y]
+		cor_fig.line(x=linerange,y=linerange,color='black')
+		# actual correlation plots
+		corplots = []
+		densplots = []
+		for label in DATA:
+			corplots.append( cor_fig.scatter(x='x',y='y',color=DATA[label]['color'],alpha=0.5,source=cor_sources[label],name=label+' corplot') )
+			densplots.append( cor_fig.rect(x='x',y='y',width='w',height='w',color=DATA[label]['color'],fill_alpha='alpha',line_alpha=0,source=dens_sources[label]) )
+
+		N_corplots = range(len(corplots)) # used in the checkbox callbacks
+
+		checkbox = CheckboxGroup(labels=DATA.keys(),active=range(len(DATA.keys())),width=100) # the group of checkboxes, one for each 'label' in DATA
+
+		iterable = [('p'+str(i),plots[i]) for i in N_plots]+[('pcor'+str(i),corplots[i]) for i in N_corplots]+[('pdens'+str(i),densplots[i]) for i in N_corplots]+[('checkbox',checkbox)] # associate each element needed in the callback to a string
+
+		# checkboxes to trigger line visibility
+		checkbox_code = """var indexOf = [].indexOf || function(item) { for (var i = 0, l = this.length; i < l; i++) { if (i in this && this[i] === item) return i; } return -1; };"""
+		checkbox_code += ''.join(['p'+str(i)+'.visible = indexOf.call(checkbox.active, '+str(i/2)+') >= 0; p'+str(i+1)+'.visible= indexOf.call(checkbox.active, '+str(i/2)+') >= 0; pcor'+str(i/2)+'.visible = indexOf.call(checkbox.active, '+str(i/2)+') >= 0; pdens'+str(i/2)+'.visible = pcor'+str(i/2)+'.visible;' for i in range(0,len(N_plots),2)])
+		# fill the correlation plots of the labels checked again if their selection changed while they were hidden
+		checkbox_code += cor_fill_js(density_points) + """
+		var doc = checkbox.document;
+		for (var c=0; c<checkbox.labels.length; c++) {
+			var name = checkbox.labels[c];
+			var scor = doc.get_model_by_name(name+' cor');
+			if (doc.get_model_by_name(name+' corplot').visible && scor.stale) {
+				fill_cor(doc.get_model_by_name(name),doc.get_model_by_name(name+' select'),scor,doc.get_model_by_name(name+' density'));
+			}
 		}
-
-		difm /= inds.length;
-		difm2 /= inds.length;
-		ym1 /= inds.length;
-		ym2 /= inds.length;
-
-		for (i=0; i < inds.length; i++){
-			scat += Math.pow(d1['y'][inds[i]] - d2['y'][inds[i]] - difm,2);
+		"""
+		checkbox.callback = CustomJS(args={key: value for key,value in iterable}, code=checkbox_code)
+
+		# button to uncheck all checkboxes
+		clear_button = Button(label='Clear all',width=100)
+		clear_button_code = """checkbox.set("active",[]);"""+checkbox_code
+		clear_button.callback = CustomJS(args={key: value for key,value in iterable}, code=clear_button_code)
+
+		# button to check all checkboxes
+		check_button = Button(label='Check all',width=100)
+		check_button_code = """checkbox.set("active","""+str(N_plots2)+""");"""+checkbox_code
+		check_button.callback = CustomJS(args={key: value for key,value in iterable}, code=check_button_code)
+
+		# button to save the table data in a .csv file
+		download_button = Button(label='Save Table to CSV',width=100)
+		download_button.callback = CustomJS(args=dict(dt=data_table),code="""
+		var tab = dt.source.data;
+		var filetext = 'Name,N,RMS,Bias,Scatter,R'+String.fromCharCode(10);
+		for (i=0; i < tab['Name'].length; i++) {
+		    var currRow = [tab['Name'][i].toString(),
+		                   tab['N'][i].toString(),
+		                   tab['RMS'][i].toString(),
+		                   tab['Bias'][i].toString(),
+		                   tab['Scatter'][i].toString(),
+		                   tab['R'][i].toString()+String.fromCharCode(10)];
+
+		    var joined = currRow.join();
+		    filetext = filetext.concat(joined);
 		}
 
-		for (i=0; i < inds.length; i++){
-			T1 += (d1['y'][inds[i]] - ym1)*(d2['y'][inds[i]] - ym2);
-			T2 += Math.pow(d1['y'][inds[i]] - ym1,2);
-			T3 += Math.pow(d2['y'][inds[i]] - ym2,2);
-		}
+		var filename = 'data_result.csv';
+		var blob = new Blob([filetext], { type: 'text/csv;charset=utf-8;' });
 
-		tab['RMS']["""+str(count)+"""] = Math.sqrt(difm2).toFixed("""+prec+""");
-		tab['Bias']["""+str(count)+"""] = difm.toFixed("""+prec+""");
-		tab['Scatter']["""+str(count)+"""] = Math.sqrt(scat/(inds.length -1)).toFixed("""+prec+""");
-		tab['R']["""+str(count)+"""] = (T1/Math.sqrt(T2*T3)).toFixed("""+prec+""");
+	    var link = document.createElement("a");
+	    link = document.createElement('a')
+	    link.href = URL.createObjectURL(blob);
+	    link.download = filename
+	    link.target = "_blank";
+	    link.style.visibility = 'hidden';
+	    link.dispatchEvent(new MouseEvent('click'))
 
-		dt.change.emit();
-		scor.change.emit();
 		""")
 
-		count+=1
+		# default text of the 'info' Div widget
+		if notes == '':
+			notes =   """
+					<font size="5"><b>Notes:</b></font></br></br>
+					<font size="2">
+					Use the "Box Select" tool to select data of interest.</br>
+					The table shows statistics between each dataset and the data shown in black.
+					</font>
+					"""
+		dumdiv = Div(text='',width=50) # dummy div widget to force a padding between gridplot elements
 
-	#get the min and max of all the data x and y
-	min_x = min([DATA[label][label]['x'][0] for label in DATA])
-	max_x = max([DATA[label][label]['x'][-1] for label in DATA])
+		info = Div(text=notes,width=400,height=300) # the information Div widget
 
-	min_y = min([min(abs(DATA[label][label]['y'])) for label in DATA])
-	max_y = max([max(DATA[label][label]['y']) for label in DATA])
+		group = widgetbox(checkbox,clear_button,check_button) # group the checkboxes and buttons in a common "widget box"
 
-	max_ampli = max_y - min_y
+		table_grid = gridplot([[txt],[download_button],[data_table]],toolbar_location=None) # group together the table, txt Div widget, and download button
 
-	# we will set the y axis range at +/- 10% of the data max amplitude
-	min_y = min_y - max_ampli*10/100
-	max_y = max_y + max_ampli*10/100
+		sub_grid = gridplot([[fig,group],[cor_fig,table_grid,dumdiv,info]],toolbar_location='left') # put everything in a grid
 
-	TOOLS = "pan,hover,wheel_zoom,box_zoom,undo,redo,reset,box_select,save" # interactive tools available in the html plot
+		grid = gridplot([[header],[sub_grid]],toolbar_location=None) # put the previous grid under the 'header' Div widget, this is done so that the toolbar of sub_grid won't appear on the side of the header.
 
-	fig = figure(output_backend="webgl",plot_width=900,plot_height=200+20*(len(DATA.keys())-2),tools=TOOLS,x_axis_type='datetime', y_range=[min_y,max_y],toolbar_location='left') # figure with the time series
+	return grid
 
-	fig.tools[-2].dimensions='width' # only allow the box select tool to select data along the X axis (will select all Y data in a given X range)
+# make a plot to compare all the pairs of n arrays
+def bok_matrix(BIN_DATA,xlab='',ylab='',sup_title='',notes='',prec='2'):
+	"""
+	- BIN_DATA is the dictionary returned by freq_bin(), with the data of every label binned once in the same intervals
 
-	UTC_offset = str((datetime(*time.gmtime()[:6])-datetime(*time.localtime()[:6])).seconds) # machine UTC offset, javascript "Date" in the callback seems to offset the time data by the UTC offset
+	There will be one statistics matrix with a tab for each of 'Bias', 'RMS' and 'R', two figures, and one "notes" text widget.
+	The element in row 'label' and column 'ref' of the matrix shows the statistics of the differences label-ref for their coincident data.
+	Clicking an element of the matrix shows the coincident time series of that pair and their correlation plot, like bok_comp() with select=ref.
+	Use pair_data() to get the data of one pair for bok_comp().
 
-	# make the BoxSelect tool update the 'txt' Div widget with the currently selected range of dates.
-	fig.tools[-2].callback = CustomJS(args=dict(txt=txt),code="""
-		var sel = cb_data["geometry"];
-		
-		var startsec = sel["x0"]/1000;
-		var start = new Date(0);
+		- 'xlab' is the label of the x axis of the time series
+		- 'ylab' is the label of the y axis of the time series
+		- 'sup_title' is the header of the html page
+		- 'notes' is a string of html code that will be displayed in a text widget beside the plots
+		- 'prec' is a "number string" that sets the precision of the values displayed in the hover tool
+	"""
+	stats = pair_stats(BIN_DATA)
+	labels = stats['labels']
 
-		start.setUTCSeconds(startsec)
+	if sup_title == '':
+		sup_title = """<font size="4">Click an element of the matrix to show the coincident data of the pair of datasets.</br>The matrix shows statistics between the dataset of each row and the dataset of each column.</font></br></br>"""
 
-		var startstring = ("0" + start.getUTCDate()).slice(-2) + "-" + ("0"+(start.getUTCMonth()+1)).slice(-2) + "-" +start.getUTCFullYear() + " " + ("0" + start.getUTCHours()).slice(-2) + ":" + ("0" + start.getUTCMinutes()).slice(-2);
+	header = Div(text=sup_title,width=700) # the title of the dashboard
 
-		var finishsec = sel["x1"]/1000;
-		var finish = new Date(0);
+	# one element per pair of labels, row i and column j are for labels[i]-labels[j]
+	rows,cols = np.indices((len(labels),len(labels)))
+	heat_source = ColumnDataSource(data={
+										'label':[labels[i] for i in rows.ravel()],
+										'ref':[labels[j] for j in cols.ravel()],
+										'N':stats['N'].ravel(),
+										'Bias':stats['Bias'].ravel(),
+										'RMS':stats['RMS'].ravel(),
+										'Scatter':stats['Scatter'].ravel(),
+										'R':stats['R'].ravel(),
+										})
+
+	# the interval numbers and averages of each label, the coincident data of a pair is found in the browser by intersecting the interval numbers
+	# the sources are given to the callback in a dictionary keyed by label, so that they are included in the document
+	bin_sources = {}
+	for label in labels:
+		bin_sources[label] = ColumnDataSource(data={'bin':BIN_DATA[label]['bin'],'x':as_datetime64(BIN_DATA[label]['x']),'y':BIN_DATA[label]['y']})
+
+	# statistics matrix, the bias colors are centered on 0
+	max_bias = np.nanmax(np.abs(stats['Bias'])) if np.any(np.isfinite(stats['Bias'])) else 1.0
+	color_ranges = {
+					'Bias':(RdBu11,-max_bias,max_bias),
+					'RMS':(Viridis256,0,np.nanmax(stats['RMS']) if np.any(np.isfinite(stats['RMS'])) else 1.0),
+					'R':(Viridis256,np.nanmin(stats['R']) if np.any(np.isfinite(stats['R'])) else 0.0,1.0),
+					}
+
+	size = max(400,40*len(labels)+150)
+	panels = []
+	for stat in ['Bias','RMS','R']:
+		palette,low,high = color_ranges[stat]
+		mapper = LinearColorMapper(palette=palette,low=low,high=high,nan_color='white')
+
+		mat_fig = figure(plot_width=size,plot_height=size,x_range=labels,y_range=labels[::-1],x_axis_location='above',tools='hover,tap,save',toolbar_location='left')
+		mat_fig.rect(x='ref',y='label',width=1,height=1,source=heat_source,fill_color={'field':stat,'transform':mapper},line_color=None)
+		mat_fig.add_layout(ColorBar(color_mapper=mapper,location=(0,0)),'right')
+		mat_fig.xaxis.major_label_orientation = np.pi/4
+		mat_fig.grid.grid_line_color = None
+
+		mat_fig.select_one(HoverTool).tooltips = [
+			('pair','@label - @ref'),
+			('N','@N'),
+			('Bias','@Bias{0.'+'0'*int(prec)+'}'),
+			('RMS','@RMS{0.'+'0'*int(prec)+'}'),
+			('Scatter','@Scatter{0.'+'0'*int(prec)+'}'),
+			('R','@R{0.'+'0'*int(prec)+'}'),
+		]
+
+		panels.append( Panel(child=mat_fig,title=stat) )
+
+	matrix = Tabs(tabs=panels)
+
+	# drill-down figures, filled with the coincident data of the clicked pair
+	label_source = ColumnDataSource(data={'x':[],'y':[]})
+	ref_source = ColumnDataSource(data={'x':[],'y':[]})
+	cor_source = ColumnDataSource(data={'x':[],'y':[]})
+
+	txt = Div(text='Click an element of the matrix',width=450)
+
+	heat_source.callback = CustomJS(args=dict(label_source=label_source,ref_source=ref_source,cor_source=cor_source,txt=txt,bin_sources=bin_sources),code="""
+	var inds = cb_obj.selected['1d'].indices;
+	if (inds.length == 0) {return;}
+	var i = inds[0];
+	var label = cb_obj.data['label'][i];
+	var ref = cb_obj.data['ref'][i];
+	var a = bin_sources[label].data;
+	var b = bin_sources[ref].data;
+
+	// intersection of the sorted interval numbers of the two labels
+	var n = cb_obj.data['N'][i];
+	var x1 = new Float64Array(n), y1 = new Float64Array(n), x2 = new Float64Array(n), y2 = new Float64Array(n);
+	var j = 0, k = 0, m = 0;
+	while ((j < a['bin'].length) && (k < b['bin'].length)) {
+		if (a['bin'][j] < b['bin'][k]) {j++;}
+		else if (a['bin'][j] > b['bin'][k]) {k++;}
+		else {
+			x1[m] = a['x'][j];
+			y1[m] = a['y'][j];
+			x2[m] = b['x'][k];
+			y2[m] = b['y'][k];
+			j++; k++; m++;
+		}
+	}
 
-		finish.setUTCSeconds(finishsec)
+	label_source.data = {'x':x1,'y':y1};
+	ref_source.data = {'x':x2,'y':y2};
+	cor_source.data = {'x':y2,'y':y1};
 
-		var finishstring = ("0" + finish.getUTCDate()).slice(-2) + "-" + ("0"+(finish.getUTCMonth()+1)).slice(-2) + "-" +finish.getUTCFullYear() + " " + ("0" + finish.getUTCHours()).slice(-2) + ":" + ("0" + finish.getUTCMinutes()).slice(-2);
+	txt.text = label+' (red) vs '+ref+' (black): N = '+n+', Bias = '+cb_obj.data['Bias'][i].toFixed("""+prec+""")+', RMS = '+cb_obj.data['RMS'][i].toFixed("""+prec+""")+', R = '+cb_obj.data['R'][i].toFixed("""+prec+""");
+	""")
 
-		txt.text = 'Selection range from '+startstring + ' to ' + finishstring;
+	#get the min and max of all the data y
+	min_y = min([np.min(BIN_DATA[label]['y']) for label in labels if len(BIN_DATA[label]['y'])])
+	max_y = max([np.max(BIN_DATA[label]['y']) for label in labels if len(BIN_DATA[label]['y'])])
 
-		txt.trigger("change"); 
-		""")
+	max_ampli = max_y - min_y
 
-	# actual time series
-	plots = []
-	for label in DATA:
-		plots.append( fig.scatter(x='x',y='y',color=DATA[label]['color'],alpha=0.5,source=sources[label][label]) )
-		plots.append( fig.scatter(x='x',y='y',color='black',alpha=0.5,source=sources[label][select]) )
+	# we will set the y axis range at +/- 10% of the data max amplitude
+	min_y = min_y - max_ampli*10/100
+	max_y = max_y + max_ampli*10/100
+
+	TOOLS = "pan,hover,wheel_zoom,box_zoom,undo,redo,reset,save" # interactive tools available in the html plot
 
-	# hover tool configuration
+	fig = figure(output_backend="webgl",plot_width=700,plot_height=250,tools=TOOLS,x_axis_type='datetime',y_range=[min_y,max_y],toolbar_location='left') # figure with the time series of the pair
+	fig.scatter(x='x',y='y',color='red',alpha=0.5,source=label_source)
+	fig.scatter(x='x',y='y',color='black',alpha=0.5,source=ref_source)
+
+	# hover tool configuration, the times are formatted by the browser
 	fig.select_one(HoverTool).tooltips = [
 		('index','$index'),
 	    ('y','@y'),
-	    ('x','@nicetime'),
+	    ('x','@x{%d-%m-%Y %H:%M:%S}'),
 	]
-
-	N_plots = range(len(plots)) # used in the checkbox callbacks
-
-	# used in the checkbox callbacks, we will trigger both 'label' and coincident 'select' data visibility at the same time
-	N_plots2 = range(len(plots)/2) 
-	even_plots = [i for i in N_plots if i%2 == 0]
-
-	# setup the legend and axis labels for the main figure
-	legend=Legend(items=[(select,[plots[1]])]+[(DATA.keys()[i],[plots[even_plots[i]]]) for i in range(len(DATA.keys()))],location=(0,0))
-	fig.add_layout(legend,'right')
+	fig.select_one(HoverTool).formatters = {'x':'datetime'}
 	fig.yaxis.axis_label = ylab
 	fig.xaxis.axis_label = xlab
 
@@ -415,86 +1154,27 @@ def bok_comp(DATA,select,xlab='',ylab='',sup_title='',notes='',prec='2'):
 	cor_fig = figure(output_backend="webgl",title = 'Correlations', plot_width = 250, plot_height = 280, x_range = [min_y,max_y], y_range = [min_y,max_y]) 
 	cor_fig.toolbar.logo = None
 	cor_fig.toolbar_location = None
-	cor_fig.xaxis.axis_label = ' '.join([select,ylab])
-	cor_fig.yaxis.axis_label = ylab
+	cor_fig.xaxis.axis_label = ' '.join(['column',ylab])
+	cor_fig.yaxis.axis_label = ' '.join(['row',ylab])
 
 	# one to one line in the correlation plot
 	linerange = list(np.arange(0,int(max_y),ceil(max_y)/10.0))+[max_y]
 	cor_fig.line(x=linerange,y=linerange,color='black')
-	# actual correlation plots
-	corplots = []
-	for label in DATA:
-		corplots.append( cor_fig.scatter(x='x',y='y',color=DATA[label]['color'],alpha=0.5,source=cor_sources[label]) )
-
-	N_corplots = range(len(corplots)) # used in the checkbox callbacks
-
-	checkbox = CheckboxGroup(labels=DATA.keys(),active=range(len(DATA.keys())),width=100) # the group of checkboxes, one for each 'label' in DATA
-
-	iterable = [('p'+str(i),plots[i]) for i in N_plots]+[('pcor'+str(i),corplots[i]) for i in N_corplots]+[('checkbox',checkbox)] # associate each element needed in the callback to a string
-
-	# checkboxes to trigger line visibility
-	checkbox_code = """var indexOf = [].indexOf || function(item) { for (var i = 0, l = this.length; i < l; i++) { if (i in this && this[i] === item) return i; } return -1; };"""
-	checkbox_code += ''.join(['p'+str(i)+'.visible = indexOf.call(checkbox.active, '+str(i/2)+') >= 0; p'+str(i+1)+'.visible= indexOf.call(checkbox.active, '+str(i/2)+') >= 0; pcor'+str(i/2)+'.visible = indexOf.call(checkbox.active, '+str(i/2)+') >= 0;' for i in range(0,len(N_plots),2)])
-	checkbox.callback = CustomJS(args={key: value for key,value in iterable}, code=checkbox_code)
-
-	# button to uncheck all checkboxes
-	clear_button = Button(label='Clear all',width=100)
-	clear_button_code = """checkbox.set("active",[]);"""+checkbox_code
-	clear_button.callback = CustomJS(args={key: value for key,value in iterable}, code=clear_button_code)
-
-	# button to check all checkboxes
-	check_button = Button(label='Check all',width=100)
-	check_button_code = """checkbox.set("active","""+str(N_plots2)+""");"""+checkbox_code
-	check_button.callback = CustomJS(args={key: value for key,value in iterable}, code=check_button_code)
-
-	# button to save the table data in a .csv file
-	download_button = Button(label='Save Table to CSV',width=100)
-	download_button.callback = CustomJS(args=dict(dt=data_table),code="""
-	var tab = dt.source.data;
-	var filetext = 'Name,N,RMS,Bias,Scatter,R'+String.fromCharCode(10);
-	for (i=0; i < tab['Name'].length; i++) {
-	    var currRow = [tab['Name'][i].toString(),
-	                   tab['N'][i].toString(),
-	                   tab['RMS'][i].toString(),
-	                   tab['Bias'][i].toString(),
-	                   tab['Scatter'][i].toString(),
-	                   tab['R'][i].toString()+String.fromCharCode(10)];
-
-	    var joined = currRow.join();
-	    filetext = filetext.concat(joined);
-	}
-
-	var filename = 'data_result.csv';
-	var blob = new Blob([filetext], { type: 'text/csv;charset=utf-8;' });
-
-    var link = document.createElement("a");
-    link = document.createElement('a')
-    link.href = URL.createObjectURL(blob);
-    link.download = filename
-    link.target = "_blank";
-    link.style.visibility = 'hidden';
-    link.dispatchEvent(new MouseEvent('click'))
-
-	""")
+	cor_fig.scatter(x='x',y='y',color='red',alpha=0.5,source=cor_source)
 
 	# default text of the 'info' Div widget
 	if notes == '':
 		notes =   """
 				<font size="5"><b>Notes:</b></font></br></br>
 				<font size="2">
-				Use the "Box Select" tool to select data of interest.</br>
-				The table shows statistics between each dataset and the data shown in black.
+				Click an element of the matrix to show the coincident data of the pair of datasets.</br>
+				The matrix shows statistics between the dataset of each row and the dataset of each column.
 				</font>
 				"""
-	dumdiv = Div(text='',width=50) # dummy div widget to force a padding between gridplot elements
 
 	info = Div(text=notes,width=400,height=300) # the information Div widget
 
-	group = widgetbox(checkbox,clear_button,check_button) # group the checkboxes and buttons in a common "widget box"
-
-	table_grid = gridplot([[txt],[download_button],[data_table]],toolbar_location=None) # group together the table, txt Div widget, and download button
-
-	sub_grid = gridplot([[fig,group],[cor_fig,table_grid,dumdiv,info]],toolbar_location='left') # put everything in a grid
+	sub_grid = gridplot([[matrix,info],[txt],[fig,cor_fig]],toolbar_location='left') # put everything in a grid
 
 	grid = gridplot([[header],[sub_grid]],toolbar_location=None) # put the previous grid under the 'header' Div widget, this is done so that the toolbar of sub_grid won't appear on the side of the header.
 
@@ -503,21 +1183,716 @@ def bok_comp(DATA,select,xlab='',ylab='',sup_title='',notes='',prec='2'):
 ###############################################################################################################################
 ###############################################################################################################################
 
-def write_html(bok_obj,tab='bokeh',save='default.html'):
+def write_html(bok_obj,tab='bokeh',save='default.html',binary=False,compress=False,profile=None):
 	"""
 	write a html bokeh plot:
 		- "save" is the full path to the html file
 		- "tab" is the string that will appear in the browser tab when oppening the html file
 		- bok_obj is any bokeh object (figure,gridplot,tabs etc.)
+		- "binary" if True, the numeric columns of the ColumnDataSources are embedded as base64 little-endian typed arrays instead of JSON lists
+			- identical columns are only embedded once and shared between sources
+			- the byte budget of each source is printed and returned
+		- "compress" if True with binary=True, the typed arrays are also zlib-compressed (decompressed by the browser with DecompressionStream)
+		- "profile" is a Profile object, the time spent in the stages 'encoding' (binary=True) and 'serialization' is added to it
 	"""
+	if not binary:
+		with profile_stage(profile,'serialization'):
+			outfile=open(save,'w')
+			outfile.write(file_html(bok_obj,CDN,tab))
+			outfile.close()
+		return
+
+	with profile_stage(profile,'encoding'):
+		store,columns,report = binary_columns(bok_obj,compress)
+
+	with profile_stage(profile,'serialization'):
+		html = binary_file_html(bok_obj,tab,store=store,columns=columns)[0]
+
 	outfile=open(save,'w')
-	outfile.write(file_html(bok_obj,CDN,tab))
+	outfile.write(html)
 	outfile.close()
 
+	print_report(report)
+
+	return report
+
+###############################################################################################################################
+###############################################################################################################################
+
+def parse_freq(FREQ):
+	"""
+	return the timedelta corresponding to FREQ
+		- FREQ must be of the form '1 hours' or '2.3 days' or '7.21 weeks', put an 's' even for 1
+		- '30 minutes' and '90 seconds' are also accepted, e.g. for the tolerance of tolerance_match()
+	"""
+	if 'weeks' in FREQ:
+		return timedelta(weeks=float(FREQ.split()[0]))
+	if 'days' in FREQ:
+		return timedelta(days=float(FREQ.split()[0]))
+	if 'hours' in FREQ:
+		return timedelta(hours=float(FREQ.split()[0]))
+	if 'minutes' in FREQ:
+		return timedelta(minutes=float(FREQ.split()[0]))
+	if 'seconds' in FREQ:
+		return timedelta(seconds=float(FREQ.split()[0]))
+
+	raise ValueError("Invalid FREQ: must be of the form '1 hours' or '2.3 days' or '7.21 weeks'")
+
+def parse_date(date):
+	"""
+	return the datetime object corresponding to a date string of the form YYYY-MM-DD-HH or YYYY-MM-DD, or None if the string is not of that form
+	"""
+	if len(date) == 13:
+		return datetime.strptime(date,'%Y-%m-%d-%H')
+	if len(date) == 10:
+		return datetime.strptime(date,'%Y-%m-%d')
+
+	return None
+
+def epoch_us(x):
+	"""
+	- x is a list or numpy.array of datetime objects (or numpy.datetime64)
+	return an int64 numpy.array of microseconds since 1970-01-01, datetime objects are assumed to be in UTC
+	"""
+	return np.asarray(x).astype('datetime64[us]').astype(np.int64)
+
+def as_datetime(date):
+	"""
+	- date is a datetime object or a numpy.datetime64
+	return the corresponding datetime object
+	"""
+	return np.datetime64(date,'us').astype(datetime)
+
+def as_datetime64(x):
+	"""
+	- x is a list or numpy.array of datetime objects or numpy.datetime64
+	return a numpy.array of numpy.datetime64[ms], which bokeh sends to the browser as numbers without formatting each date in python
+	"""
+	return np.asarray(x).astype('datetime64[ms]')
+
+def datetime64_columns(data):
+	"""
+	- data is a dictionary {'x':[...],'y':[...],...} of one time series
+	return a copy of data with 'x' as numpy.datetime64[ms], to be used as the data of a ColumnDataSource
+	"""
+	columns = dict(data)
+	columns['x'] = as_datetime64(data['x'])
+
+	return columns
+
+def epoch_to_datetime(sec):
+	"""
+	- sec is a list or numpy.array of integer seconds since 1970-01-01
+	return a numpy.array of datetime objects (UTC)
+	"""
+	return np.asarray(sec,dtype=np.int64).astype('datetime64[s]').astype(datetime)
+
+class IntervalIndex(object):
+	"""
+	index of the data of one label in the 'span' intervals [t0+k*time_step,t0+(k+1)*time_step[
+	it is built once with one sort, and used to sum, average or compute statistics of any column of the data in each interval (see bin_sums() and bin_stats())
+
+	- x,t0,time_step,span are the same as in bin_sums()
+
+	the numpy.array attributes are:
+		- bins: the sorted interval numbers that have data
+		- order: the indices of the data in the intervals, sorted by interval and in their original order within each interval
+		- offsets: the data of interval bins[p] are order[offsets[p]:offsets[p+1]] (compressed sparse row layout)
+		- counts: the number of data in each interval of bins
+		- times: the times of the data in microseconds since 1970-01-01
+
+	index.samples(k) returns the indices of the data in interval k with a binary search of 'bins'
+	freq_match() makes one index per label and uses it for the interval sums and the statistics
+	"""
+	def __init__(self,x,t0,time_step,span):
+		step = time_step.days*86400*10**6+time_step.seconds*10**6+time_step.microseconds
+
+		self.span = span
+		self.times = epoch_us(x)
+
+		ids = (self.times-epoch_us([t0])[0])//step
+		inside = (ids>=0) & (ids<span)
+
+		self.order = np.flatnonzero(inside)[np.argsort(ids[inside],kind='mergesort')] # stable sort, data in each interval stays in its original order
+		sorted_ids = ids[self.order]
+
+		starts = np.flatnonzero(np.concatenate(([True],sorted_ids[1:]!=sorted_ids[:-1]))) if len(sorted_ids) else np.array([],dtype=np.int64) # index of the first element of each interval
+
+		self.bins = sorted_ids[starts]
+		self.offsets = np.append(starts,len(sorted_ids))
+		self.counts = np.diff(self.offsets)
+
+	def samples(self,k):
+		"""
+		returns the indices of the data in interval number k
+		"""
+		position = np.searchsorted(self.bins,k)
+		if (position == len(self.bins)) or (self.bins[position] != k):
+			return np.array([],dtype=np.int64)
+
+		return self.order[self.offsets[position]:self.offsets[position+1]]
+
+	def sums(self,values):
+		"""
+		- values is a numpy.array with one value per data
+
+		returns the sum of the values in each interval of 'bins'
+		"""
+		values = np.asarray(values)[self.order]
+		if len(values)==0:
+			return values
+
+		return np.add.reduceat(values,self.offsets[:-1])
+
+	def means(self,values):
+		"""
+		returns the average of the values in each interval of 'bins'
+		"""
+		return self.sums(np.asarray(values,dtype=np.float64))/self.counts
+
+	def value_order(self,values):
+		"""
+		returns the indices of the data in the intervals sorted by interval, and by value within each interval, to compute order statistics (e.g. median)
+		the intervals keep the same offsets as in 'order'
+		"""
+		values = np.asarray(values,dtype=np.float64)[self.order]
+
+		return self.order[np.lexsort((values,np.repeat(np.arange(len(self.bins)),self.counts)))]
+
+def empty_bin_sums():
+	"""
+	returns a dictionary like the one returned by bin_sums() for data with no element in any interval
+	"""
+	return {'bin':np.array([],dtype=np.int64),'n':np.array([],dtype=np.int64),'tsum':np.array([],dtype=np.int64),'ysum':np.array([],dtype=np.float64)}
+
+def bin_sums(x,y,t0,time_step,span,index=None):
+	"""
+	Sort the data of one label in the 'span' intervals [t0+k*time_step,t0+(k+1)*time_step[ and sum it in each interval
+
+	- x is a numpy.array of datetime objects
+	- y is a numpy.array of values
+	- t0 is the datetime object of the start of the first interval
+	- time_step is the timedelta object of the length of the intervals
+	- span is the number of intervals
+
+	returns a dictionary of numpy.arrays with one element per interval that has data:
+		- 'bin' is the sorted interval number k
+		- 'n' is the number of data in the interval
+		- 'tsum' is the sum of the data times in integer seconds since 1970-01-01
+		- 'ysum' is the sum of the data values
+
+	each element is assigned to its interval with one floor division and the sums are computed on the sorted intervals with np.add.reduceat, the cost is O(N log N)
+	index is the IntervalIndex of x, if it was already made for the same t0, time_step and span
+	"""
+	if index is None:
+		index = IntervalIndex(x,t0,time_step,span)
+
+	if len(index.bins)==0:
+		return empty_bin_sums()
+
+	return {
+			'bin':index.bins,
+			'n':index.counts,
+			'tsum':index.sums(index.times//10**6),
+			'ysum':index.sums(np.asarray(y,dtype=np.float64)),
+			}
+
+def bin_means(sums,bins):
+	"""
+	- sums is a dictionary returned by bin_sums()
+	- bins is a sorted numpy.array of interval numbers that are all in sums['bin']
+
+	returns a dictionary {'x':[...],'y':[...]} with the average time (numpy.datetime64[ms]) and value of the data in each interval
+	"""
+	pos = np.searchsorted(sums['bin'],bins)
+	n = sums['n'][pos]
+
+	# the time range is divided in intervals of FREQ, but the data isn't necessarily evenly distributed in time in each intervals, thus I use the average time of the data in each interval
+	return {'x':(sums['tsum'][pos]//n).astype('datetime64[s]').astype('datetime64[ms]'),'y':sums['ysum'][pos]/n}
+
+# statistics that can be computed in each interval by bin_stats(), in addition to the mean
+bin_stat_names = ['count','median','trim_mean','std','wmean']
+
+# columns added to the data by bin_stats(), 'wmean' also gives its uncertainty 'wmean_err'
+bin_stat_columns = ['count','median','trim_mean','std','wmean','wmean_err']
+
+def check_bin_stats(stats,trim):
+	"""
+	raises ValueError if a name in stats is not in bin_stat_names or if trim is not in [0,0.5[
+	"""
+	unknown = [stat for stat in stats if stat not in bin_stat_names]
+	if unknown:
+		raise ValueError('Unknown statistics '+', '.join(unknown)+', they must be in '+', '.join(bin_stat_names))
+
+	if not (0 <= trim < 0.5):
+		raise ValueError('trim must be in [0,0.5[, it is the fraction of the data removed on each side of the intervals')
+
+def bin_stats(x,y,t0,time_step,span,stats=bin_stat_names,err=None,trim=0.1,index=None):
+	"""
+	Other statistics than the mean of the data of one label in the 'span' intervals [t0+k*time_step,t0+(k+1)*time_step[
+
+	- x,y,t0,time_step,span are the same as in bin_sums()
+	- stats is a list of names from bin_stat_names:
+		- 'count' the number of data in the interval
+		- 'median' the median value
+		- 'trim_mean' the mean value without the lowest and highest 'trim' fraction of the data (e.g. trim=0.1 removes 10% on each side)
+		- 'std' the standard deviation of the values (NaN with only one data)
+		- 'wmean' the mean value weighted by 1/err**2, and its uncertainty 'wmean_err'
+	- err is a numpy.array of the uncertainty of each y value, needed for 'wmean'
+	- index is the IntervalIndex of x, if it was already made for the same t0, time_step and span
+
+	returns a dictionary of numpy.arrays with one element per interval that has data: 'bin' the sorted interval number, and one array per statistic
+
+	the data is sorted once by interval and value, so all the statistics of all the intervals are computed with array operations on the sorted values, the cost is O(N log N)
+	raises ValueError if a statistic is unknown, if 'wmean' is asked without err, or if trim is not in [0,0.5[
+	"""
+	check_bin_stats(stats,trim)
+	if ('wmean' in stats) and (err is None):
+		raise ValueError("'wmean' needs the uncertainty err of each value")
+
+	if index is None:
+		index = IntervalIndex(x,t0,time_step,span)
+
+	order = index.value_order(y) # sorted by interval, and by value within each interval
+	y = np.asarray(y,dtype=np.float64)[order]
+
+	starts = index.offsets[:-1]
+	n = index.counts
+
+	result = {'bin':index.bins}
+
+	if 'count' in stats:
+		result['count'] = n
+
+	if 'median' in stats:
+		result['median'] = (y[starts+(n-1)//2]+y[starts+n//2])/2
+
+	if 'trim_mean' in stats:
+		cum_y = np.concatenate(([0.0],np.cumsum(y)))
+		k = np.floor(trim*n).astype(np.int64) # number of data removed on each side
+		result['trim_mean'] = (cum_y[starts+n-k]-cum_y[starts+k])/(n-2*k)
+
+	if 'std' in stats:
+		mean = np.add.reduceat(y,starts)/n if len(y) else np.array([])
+		with np.errstate(divide='ignore',invalid='ignore'):
+			result['std'] = np.sqrt(np.add.reduceat((y-np.repeat(mean,n))**2,starts)/(n-1)) if len(y) else np.array([])
+
+	if 'wmean' in stats:
+		weights = 1.0/np.asarray(err,dtype=np.float64)[order]**2
+		sum_weights = np.add.reduceat(weights,starts) if len(y) else np.array([])
+		result['wmean'] = np.add.reduceat(weights*y,starts)/sum_weights if len(y) else np.array([])
+		result['wmean_err'] = 1.0/np.sqrt(sum_weights)
+
+	return result
+
+def add_bin_stats(means,stats,bins):
+	"""
+	- means is a dictionary {'x':[...],'y':[...]} returned by bin_means() for the intervals 'bins'
+	- stats is the dictionary returned by bin_stats() for the same data, all the intervals of 'bins' must be in stats['bin']
+
+	returns a copy of 'means' with the columns of 'stats' for the intervals 'bins'
+	"""
+	pos = np.searchsorted(stats['bin'],bins)
+
+	columns = dict(means)
+	for key in stats:
+		if key != 'bin':
+			columns[key] = stats[key][pos]
+
+	return columns
+
+def merge_bin_sums(sums_list):
+	"""
+	- sums_list is a list of dictionaries returned by bin_sums() for the same t0 and time_step (e.g. for successive chunks of the data of one label)
+
+	returns the dictionary that bin_sums() would return for all the data at once, the sums of intervals present in several dictionaries are added
+	"""
+	ids = np.concatenate([empty_bin_sums()['bin']]+[sums['bin'] for sums in sums_list])
+
+	if len(ids)==0:
+		return empty_bin_sums()
+
+	order = np.argsort(ids,kind='mergesort')
+	ids = ids[order]
+
+	starts = np.flatnonzero(np.concatenate(([True],ids[1:]!=ids[:-1])))
+
+	merged = {'bin':ids[starts]}
+	for key in ['n','tsum','ysum']:
+		merged[key] = np.add.reduceat(np.concatenate([sums[key] for sums in sums_list])[order],starts)
+
+	return merged
+
+def update_bin_sums(previous,x,y,t0,time_step,span,start_bin=0):
+	"""
+	bin_sums() of one label where only the data at or after the start of interval 'start_bin' is binned
+
+	- previous is a dictionary returned by bin_sums() for the same label, t0 and time_step in a previous run, its intervals before 'start_bin' are kept as they are
+	- x must be sorted in time, the data before interval 'start_bin' is skipped with a binary search so the cost only depends on the amount of new data
+
+	if previous is None, all the data is binned
+	"""
+	if previous is None:
+		return bin_sums(x,y,t0,time_step,span)
+
+	x = np.asarray(x)
+	start = t0+int(start_bin)*time_step
+	if x.dtype.kind == 'M':
+		start = np.datetime64(start,'us')
+	first = np.searchsorted(x,start)
+
+	new = bin_sums(x[first:],np.asarray(y)[first:],t0,time_step,span)
+
+	keep = (previous['bin']<start_bin) & (previous['bin']<span)
+
+	return {key:np.concatenate((previous[key][keep],new[key])) for key in new}
+
+def watermark_bin(previous,watermark,t0,time_step):
+	"""
+	returns the first interval to be binned again by update_bin_sums()
+
+	- previous is a dictionary returned by bin_sums() in a previous run
+	- watermark is a datetime object, the interval that contains it and all the following intervals will be binned again
+	if watermark is None, the last interval with data in 'previous' and all the following intervals will be binned again
+	"""
+	if watermark is not None:
+		step = time_step.days*86400*10**6+time_step.seconds*10**6+time_step.microseconds
+		return max(0,(epoch_us([watermark])[0]-epoch_us([t0])[0])//step)
+
+	if len(previous['bin'])==0:
+		return 0
+
+	return previous['bin'][-1]
+
+def match_sums(select_sums,label_sums):
+	"""
+	- select_sums and label_sums are the dictionaries returned by bin_sums() for the 'select' and label data
+
+	returns (matched_bins,select_means,label_means):
+		- matched_bins is the array of intervals with data from both 'select' and the label
+		- select_means and label_means are the dictionaries returned by bin_means() for these intervals
+	"""
+	# intervals of FREQ with data from both 'select' and 'label'
+	matched_bins = np.intersect1d(select_sums['bin'],label_sums['bin'],assume_unique=True)
+
+	return matched_bins,bin_means(select_sums,matched_bins),bin_means(label_sums,matched_bins)
+
+def match_label(select_sums,x,y,t0,time_step,span,previous=None,start_bin=0,index=None):
+	"""
+	- select_sums is the dictionary returned by bin_sums() for the 'select' data
+	- x,y,t0,time_step,span,index are the inputs of bin_sums() for the label data
+	- previous and start_bin are the inputs of update_bin_sums() for the label data, index is not used with previous
+
+	returns (matched_bins,select_means,label_means,label_sums):
+		- matched_bins is the array of intervals with data from both 'select' and the label
+		- select_means and label_means are the dictionaries returned by bin_means() for these intervals
+		- label_sums is the dictionary returned by bin_sums() for the label data
+	"""
+	if previous is None:
+		label_sums = bin_sums(x,y,t0,time_step,span,index)
+	else:
+		label_sums = update_bin_sums(previous,x,y,t0,time_step,span,start_bin)
+
+	return match_sums(select_sums,label_sums)+(label_sums,)
+
+def save_bin_sums(sums,path):
+	"""
+	save each array of a dictionary returned by bin_sums() as a .npy file in the 'path' directory
+	"""
+	for key in sums:
+		np.save(os.path.join(path,key+'.npy'),sums[key])
+
+def load_bin_sums(path):
+	"""
+	load the .npy files written by save_bin_sums() as memory-mapped arrays
+	"""
+	return {key:np.load(os.path.join(path,key+'.npy'),mmap_mode='r') for key in ['bin','n','tsum','ysum']}
+
+select_sums_cache = {} # the 'select' interval sums loaded by each worker process, keyed by directory
+
+def match_label_worker(label,x,y,t0,time_step,span,select_path,previous=None,start_bin=0,stats=[],err=None,trim=0.1):
+	"""
+	match_label() for one label in a worker process of freq_match(), the 'select' interval sums are loaded once per process from 'select_path'
+	if stats are given, bin_stats() is also computed in the worker with the same IntervalIndex
+
+	returns (label,output of match_label(),output of bin_stats() or None,time spent in seconds)
+	"""
+	milestone = time.time()
+
+	if select_path not in select_sums_cache:
+		select_sums_cache[select_path] = load_bin_sums(select_path)
+
+	index = IntervalIndex(x,t0,time_step,span) if previous is None else None
+
+	result = match_label(select_sums_cache[select_path],x,y,t0,time_step,span,previous,start_bin,index)
+
+	label_stats = bin_stats(x,y,t0,time_step,span,stats,err,trim,index) if stats else None
+
+	return label,result,label_stats,time.time()-milestone
+
+def freq_match_key(DATA,select,FREQ,date_range,stats=[],err='err',trim=0.1,previous_state=None,watermark=None):
+	"""
+	returns a hash string identifying the result of freq_match(DATA,select,FREQ,date_range,stats=stats,err=err,trim=trim)
+
+	it is computed from select, FREQ, date_range and a fingerprint of the times and values of each label in DATA
+	with a 'state' in freq_match(), previous_state is the dictionary returned by load_freq_state() (None if the state did not exist yet), its interval sums and the watermark are also part of the key
+	"""
+	key = hashlib.sha1()
+	key.update(json.dumps(['freq_match',1,select,FREQ,[str(date) for date in date_range]]).encode('utf-8'))
+	if stats:
+		key.update(json.dumps([list(stats),err,trim]).encode('utf-8'))
+	if previous_state is not None:
+		key.update(json.dumps(['state',str(previous_state['t0']),previous_state['span'],str(watermark)]).encode('utf-8'))
+		for label in previous_state['sums']:
+			key.update(json.dumps([label]).encode('utf-8'))
+			for column in ['bin','n','tsum','ysum']:
+				key.update(np.ascontiguousarray(previous_state['sums'][label][column]).tobytes())
+	elif watermark is not None:
+		key.update(json.dumps(['watermark',str(watermark)]).encode('utf-8'))
+	for label in DATA:
+		key.update(json.dumps([label,len(DATA[label]['x'])]).encode('utf-8'))
+		key.update(epoch_us(DATA[label]['x']).tobytes())
+		key.update(np.ascontiguousarray(DATA[label]['y'],dtype=np.float64).tobytes())
+		if 'wmean' in stats:
+			key.update(np.ascontiguousarray(DATA[label][err],dtype=np.float64).tobytes())
+
+	return key.hexdigest()
+
+def save_freq_data(FREQ_DATA,select,path):
+	"""
+	save a dictionary returned by freq_match() in the 'path' directory:
+		- one .npy file per column, int64 for the times (seconds since 1970-01-01) and the counts, float64 for the values and the other columns of bin_stats()
+		- a manifest.json file with the labels and the name of their files
+
+	the directory is first written under a temporary name and then renamed, so an interrupted save never leaves a partial 'path'
+	"""
+	temp_path = tempfile.mkdtemp(prefix='.freq_data_',dir=os.path.dirname(os.path.abspath(path)))
+
+	manifest = {'select':select,'labels':[]}
+	for it,label in enumerate(FREQ_DATA):
+		files = {}
+		for key,name in [(label,'label'),(select,'select')]:
+			files[name] = {}
+			for column in FREQ_DATA[label][key]:
+				files[name][column] = '{}_{}_{}.npy'.format(it,name,column)
+				if column == 'x':
+					np.save(os.path.join(temp_path,files[name]['x']),epoch_us(FREQ_DATA[label][key]['x'])//10**6)
+				else:
+					np.save(os.path.join(temp_path,files[name][column]),np.asarray(FREQ_DATA[label][key][column],dtype=np.int64 if column == 'count' else np.float64))
+		manifest['labels'].append({'label':label,'files':files})
+
+	with open(os.path.join(temp_path,'manifest.json'),'w') as outfile:
+		json.dump(manifest,outfile,indent=1)
+
+	try:
+		os.rename(temp_path,path)
+	except OSError: # another process saved the same data in the meantime
+		shutil.rmtree(temp_path)
+
+def load_freq_data(path):
+	"""
+	load a dictionary saved by save_freq_data(), the columns are memory-mapped and nothing is unpickled
+
+	returns a dictionary that can directly be used in the function bok_comp(), the times are numpy.datetime64[ms] like in the output of freq_match()
+	"""
+	with open(os.path.join(path,'manifest.json'),'r') as infile:
+		manifest = json.load(infile)
+
+	select = manifest['select']
+
+	FREQ_DATA = OrderedDict()
+	for entry in manifest['labels']:
+		label = entry['label']
+		FREQ_DATA[label] = {}
+		for key,name in [(select,'select'),(label,'label')]:
+			files = entry['files'][name]
+			FREQ_DATA[label][key] = {column:np.load(os.path.join(path,files[column]),mmap_mode='r') for column in files}
+			FREQ_DATA[label][key]['x'] = FREQ_DATA[label][key]['x'].view('datetime64[s]').astype('datetime64[ms]')
+
+	return FREQ_DATA
+
+def replace_dir(temp_path,path):
+	"""
+	move the directory 'temp_path' to 'path', replacing 'path' if it already exists
+	"""
+	if os.path.isdir(path):
+		old_path = tempfile.mkdtemp(prefix='.old_',dir=os.path.dirname(os.path.abspath(path)))
+		os.rmdir(old_path)
+		os.rename(path,old_path)
+		os.rename(temp_path,path)
+		shutil.rmtree(old_path)
+	else:
+		os.rename(temp_path,path)
+
+def save_freq_state(state,path):
+	"""
+	save the interval sums of a freq_match() run in the 'path' directory so that a later run can only process new data
+
+	- state is a dictionary {'select':select,'FREQ':FREQ,'t0':datetime,'span':span,'sums':{label:output of bin_sums(),...}}
+
+	the 'path' directory has a manifest.json file and one sub-directory of .npy files (see save_bin_sums()) per label
+	"""
+	temp_path = tempfile.mkdtemp(prefix='.freq_state_',dir=os.path.dirname(os.path.abspath(path)))
+
+	manifest = {'select':state['select'],'FREQ':state['FREQ'],'t0':int(epoch_us([state['t0']])[0]),'span':int(state['span']),'labels':[]}
+	for it,label in enumerate(state['sums']):
+		os.mkdir(os.path.join(temp_path,str(it)))
+		save_bin_sums(state['sums'][label],os.path.join(temp_path,str(it)))
+		manifest['labels'].append({'label':label,'dir':str(it)})
+
+	with open(os.path.join(temp_path,'manifest.json'),'w') as outfile:
+		json.dump(manifest,outfile,indent=1)
+
+	replace_dir(temp_path,path)
+
+def load_freq_state(path):
+	"""
+	load the dictionary saved by save_freq_state(), the interval sums are loaded in memory
+	"""
+	with open(os.path.join(path,'manifest.json'),'r') as infile:
+		manifest = json.load(infile)
+
+	sums = OrderedDict()
+	for entry in manifest['labels']:
+		sums[entry['label']] = {key:np.array(value) for key,value in load_bin_sums(os.path.join(path,entry['dir'])).items()}
+
+	return {
+			'select':manifest['select'],
+			'FREQ':manifest['FREQ'],
+			't0':epoch_to_datetime([manifest['t0']//10**6])[0]+timedelta(microseconds=manifest['t0']%10**6),
+			'span':manifest['span'],
+			'sums':sums,
+			}
+
+def column_tree(node,columns):
+	"""
+	describe a dictionary of columns for save_columns()
+
+	- node is a dictionary, a column (list or numpy.array), or a single value
+	- columns is an OrderedDict where the int64/float64/bool/string numpy.arrays of the columns are added
+
+	returns the JSON-compatible description of node, where each column is replaced by its name in 'columns' and its type
+	tuples (e.g. the RGB colors of kelly_colors) are single values, not columns
+	"""
+	if isinstance(node,dict):
+		return {'dict':[[key,column_tree(node[key],columns)] for key in node]} # a list of pairs to keep the order of the keys
+
+	if isinstance(node,tuple):
+		return {'tuple':[item.item() if isinstance(item,np.generic) else item for item in node]}
+
+	if isinstance(node,(list,np.ndarray)):
+		values = np.asarray(node)
+		if (values.dtype.kind == 'O') and len(values) and isinstance(values.flat[0],datetime):
+			values = values.astype('datetime64[us]')
+		elif (values.dtype.kind == 'O') and len(values)==0:
+			values = values.astype(np.float64) # an empty column has no type
+
+		name = 'c'+str(len(columns))
+		if values.dtype.kind == 'M':
+			columns[name] = values.astype('datetime64[us]').astype(np.int64)
+			return {'column':name,'type':'datetime64[us]'}
+		if values.dtype.kind == 'f':
+			columns[name] = values.astype(np.float64)
+		elif values.dtype.kind in 'iu':
+			columns[name] = values.astype(np.int64)
+		elif values.dtype.kind in 'bSU':
+			columns[name] = values
+		else:
+			raise TypeError('Invalid column: only numbers, dates and strings can be saved without pickling')
+		return {'column':name,'type':str(columns[name].dtype)}
+
+	if isinstance(node,np.generic):
+		node = node.item()
+
+	return {'value':node}
+
+def save_columns(DATA,path):
+	"""
+	save a dictionary of columns without pickling, e.g. the DATA of freq_match() and bok_series() or the FREQ_DATA of bok_comp():
+		- the numbers are saved as int64 or float64 columns, the datetime objects and numpy.datetime64 as int64 microseconds since 1970-01-01
+		- the values that are not columns (e.g. 'color') and the structure of the dictionary are saved in a JSON manifest
+
+	- path is where the data is saved:
+		- if it ends with '.npz', everything is saved in that single file
+		- otherwise, in a 'path' directory with one .npy file per column and a manifest.json file, which can be memory-mapped by load_columns()
+	"""
+	columns = OrderedDict()
+	manifest = {'format':'comp_plot columns','version':1,'tree':column_tree(DATA,columns)}
+
+	if path.endswith('.npz'):
+		columns['manifest'] = np.frombuffer(json.dumps(manifest).encode('utf-8'),dtype=np.uint8)
+		handle,temp_path = tempfile.mkstemp(suffix='.npz',dir=os.path.dirname(os.path.abspath(path)))
+		with os.fdopen(handle,'wb') as outfile:
+			np.savez(outfile,**columns)
+		if os.path.exists(path):
+			os.remove(path)
+		os.rename(temp_path,path)
+		return
+
+	temp_path = tempfile.mkdtemp(prefix='.columns_',dir=os.path.dirname(os.path.abspath(path)))
+	for name in columns:
+		np.save(os.path.join(temp_path,name+'.npy'),columns[name])
+	with open(os.path.join(temp_path,'manifest.json'),'w') as outfile:
+		json.dump(manifest,outfile,indent=1)
+
+	replace_dir(temp_path,path)
+
+def columns_from_tree(node,load):
+	"""
+	rebuild the dictionary described by column_tree(), load(name) returns the numpy.array of the column 'name'
+	"""
+	if 'dict' in node:
+		return OrderedDict([(key,columns_from_tree(value,load)) for key,value in node['dict']])
+
+	if 'column' in node:
+		values = load(node['column'])
+		if node['type'] == 'datetime64[us]':
+			return values.view('datetime64[us]')
+		return values
+
+	if 'tuple' in node:
+		return tuple(node['tuple'])
+
+	return node['value']
+
+def load_columns(path):
+	"""
+	load a dictionary saved by save_columns(), nothing is unpickled
+
+	- from a directory, the columns are memory-mapped: only the parts of the data that are used are read from the disk
+	- from a .npz file, each column is read when the dictionary is built
+
+	the dates are numpy.datetime64[us] and the dictionaries are OrderedDicts in the order they were saved
+	"""
+	if path.endswith('.npz'):
+		with np.load(path) as infile:
+			manifest = json.loads(infile['manifest'].tobytes().decode('utf-8'))
+			return columns_from_tree(manifest['tree'],lambda name: infile[name])
+
+	with open(os.path.join(path,'manifest.json'),'r') as infile:
+		manifest = json.load(infile)
+
+	return columns_from_tree(manifest['tree'],lambda name: np.load(os.path.join(path,name+'.npy'),mmap_mode='r'))
+
+def convert_npy(npy_path,path):
+	"""
+	convert a dictionary pickled in a .npy file (e.g. the sample data of the examples, saved with np.save(npy_path,DATA) in python 2) to the format of save_columns()
+
+	- npy_path is the path to the .npy file
+	- path is the path given to save_columns()
+
+	returns the dictionary loaded with load_columns(path)
+	"""
+	DATA = np.load(npy_path,allow_pickle=True,encoding='latin1').item()
+
+	save_columns(DATA,path)
+
+	return load_columns(path)
+
 ###############################################################################################################################
 ###############################################################################################################################
 
-def freq_match(DATA,select,FREQ,date_range=[None,None],save=''):
+def freq_match(DATA,select,FREQ,date_range=[None,None],save='',workers=None,cache_dir='',state='',watermark=None,stats=[],err='err',trim=0.1,profile=None):
 	"""
 	- DATA is a dictionary of the form
 	{ 
@@ -525,150 +1900,584 @@ def freq_match(DATA,select,FREQ,date_range=[None,None],save=''):
 		'label1': {'x':[...],'y':[...]},
 		etc ...
 	}
-	with each 'label' associated with x (datetime) and y values
+	with each 'label' associated with x (datetime objects or numpy.datetime64) and y values
 
 	- select is one of the labels, all other 'label' data will be filtered to only keep coincident data.
 	- date_range[0] is the starting date for the matching & averaging YYYY-MM-DD-HH (e.g. 2010-01-02-14 for 2 PM January 2nd 2010, -HH is optional)
 	- date_range[1] is the end date for the matching & averaging
 	- FREQ is the frequency of data matching & averaging, date_range will be divided in intervals of FREQ 
 		- FREQ must be of the form '1 hours' or '2.3 days' or '7.21 weeks', put an 's' even for 1
-		- Matching and averaging can be very time consuming for the smaller frequencies
 	- save is the full path to where the FREQly matched and averaged data will be saved, if not specified the data will not be saved.
+	- workers is the number of processes used to match the labels in parallel, if not specified the labels are matched one after the other.
+	- cache_dir is the full path to a directory where the results are cached, keyed by a hash of the inputs; if the same inputs were already matched the result is loaded from the cache instead of being recomputed (with "state", the previous state is part of the key and the new state is also saved on a cache hit).
+	- state is the full path to a directory where the sums of data in each interval of FREQ are saved at the end of the run.
+		- if it already exists, the previous sums are used: only the intervals at or after 'watermark' are binned again and merged with them, and the intervals start from the previous date_range[0]
+		- this way DATA only needs to contain the new data (and any data in the interval of the watermark), the cost of an update is proportional to the new data and not the whole archive
+		- the x data must be sorted in time
+	- watermark is a datetime object, if not specified each label is binned again from its last interval with data in 'state'
+	- stats is a list of other statistics computed in each interval in addition to the mean, from bin_stat_names: 'count','median','trim_mean','std','wmean'
+		- they are added as extra columns next to 'x' and 'y' (see bin_stats()), and shown in the hover tool of bok_comp()
+		- err is the name of the column of DATA with the uncertainty of each value, used for the error-weighted mean 'wmean'
+		- trim is the fraction of the data removed on each side of the interval for the trimmed mean 'trim_mean'
+		- they can't be used with 'state' since they need all the data of each interval
+	- profile is a Profile object, the time spent in the stages 'cache', 'binning', 'matching' (for each label), 'statistics' and 'save' is added to it
 	"""
 
 	if None in date_range:
-		t0 = DATA[select]['x'][0]
-		tf = DATA[select]['x'][-1]
+		t0 = as_datetime(DATA[select]['x'][0])
+		tf = as_datetime(DATA[select]['x'][-1])
 	else:
-		start = date_range[0]
-		end = date_range[1]
-
-		t0 = ''
-		while type(t0) != datetime: 
-			if len(start) in [10,13]:	
-				if len(start) == 13:
-					t0 = datetime.strptime(start,'%Y-%m-%d-%H')
-				else:
-					t0 = datetime.strptime(start,'%Y-%m-%d')
-			else:
-				print("Invalid input")
-				return "Invalid input: date_range[0] must be of the form 'YYY-MM-DD-HH'"
-
-		tf = ''	
-		while type(tf) != datetime: 
-			if len(end) in [10,13]:
-				if len(end) == 13:
-					tf = datetime.strptime(end,'%Y-%m-%d-%H')
-				else:
-					tf = datetime.strptime(end,'%Y-%m-%d')
-			else:
-				print("Invalid input")
-				return "Invalid input: date_range[1] must be of the form 'YYY-MM-DD-HH'"
+		t0 = parse_date(date_range[0])
+		if t0 is None:
+			print("Invalid input")
+			return "Invalid input: date_range[0] must be of the form 'YYY-MM-DD-HH'"
 
+		tf = parse_date(date_range[1])
+		if tf is None:
+			print("Invalid input")
+			return "Invalid input: date_range[1] must be of the form 'YYY-MM-DD-HH'"
 
-			if type(tf) == datetime:
-				if tf < t0:
-					print("The starting date shall precede the end date")
-					return 'Invalid input: date_range[1] < date_range[0]'
+		if tf < t0:
+			print("The starting date shall precede the end date")
+			return 'Invalid input: date_range[1] < date_range[0]'
 
+	time_step = parse_freq(FREQ)
+
+	frequency = time_step.total_seconds()
+
+	if stats and (state != ''):
+		print("stats can't be used with state")
+		return 'Invalid input: the statistics '+', '.join(stats)+' need all the data of each interval and cannot be updated from a state'
+
+	if stats:
+		check_bin_stats(stats,trim)
+		if 'wmean' in stats:
+			no_err = [label for label in DATA if err not in DATA[label]]
+			if no_err:
+				raise ValueError("'wmean' needs the '"+err+"' column with the uncertainty of each value, it is missing for "+', '.join(no_err))
+
+	previous = {} # interval sums of each label from the previous run
+	previous_span = 0
+	previous_state = None
+	if state != '' and os.path.isdir(state):
+		previous_state = load_freq_state(state)
+		if (previous_state['select'] != select) or (parse_freq(previous_state['FREQ']) != time_step):
+			print("The state was saved for different select / FREQ")
+			return 'Invalid input: the state in '+state+' was made with select='+previous_state['select']+' and FREQ='+previous_state['FREQ']
+		if (None not in date_range) and (t0 != previous_state['t0']):
+			print("The starting date is different from the one of the state")
+			return 'Invalid input: date_range[0] must be the same as in the state in '+state
+		t0 = previous_state['t0']
+		previous = previous_state['sums']
+		previous_span = previous_state['span']
+		print('Updating the intervals of',FREQ,'saved in',state)
 
 	print(select,'time range:\nStart',t0.strftime('%d-%m-%Y %H:%M'),'\nEnd',tf.strftime('%d-%m-%Y %H:%M'))
 
-	FREQ_DATA = {}
+	if cache_dir != '':
+		cache_path = os.path.join(cache_dir,freq_match_key(DATA,select,FREQ,date_range,stats,err,trim,previous_state,watermark))
+		# with a state, the interval sums of the run are cached in cache_path+'_state' and copied to the state on a cache hit
+		if os.path.isdir(cache_path) and ((state == '') or os.path.isdir(cache_path+'_state')):
+			print('Loading cached matches from',cache_path)
+			with profile_stage(profile,'cache'):
+				FREQ_DATA = load_freq_data(cache_path)
+				if state != '':
+					save_freq_state(load_freq_state(cache_path+'_state'),state)
+			with profile_stage(profile,'save'):
+				if save != '':
+					np.save(save,FREQ_DATA)
+			return FREQ_DATA
 
-	if 'weeks' in FREQ:
-		time_step = timedelta(weeks=float(FREQ.split()[0]))
-	if 'days' in FREQ:
-		time_step = timedelta(days=float(FREQ.split()[0]))
-	if 'hours' in FREQ:
-		time_step = timedelta(hours=float(FREQ.split()[0]))
+	FREQ_DATA = {}
 
-	frequency = time_step.total_seconds()
+	span = max(int(ceil((tf-t0).total_seconds()/frequency)),previous_span)
 
-	span = int(ceil((tf-t0).total_seconds()/frequency))
+	# first interval to bin for each label of the previous run, the intervals before it are taken from the previous run
+	# labels of the previous run without new data keep all their previous interval sums
+	start_bins = {label:watermark_bin(previous[label],watermark,t0,time_step) if label in DATA else span for label in previous}
+	no_data = {'x':np.array([],dtype='datetime64[us]'),'y':np.array([],dtype=np.float64)}
 
 	milestone = time.time()
 	print('Dividing',select,'time range in',span,'intervals of',FREQ)
-	tmin = t0
-	temp = [[] for i in range(span)]
-	for interval in range(span):
-		progress(interval,span,char=select)
-		tmax = tmin+time_step
-		times = DATA[select]['x'][(DATA[select]['x']>=tmin) & (DATA[select]['x']<tmax)]
-		times_ID=np.nonzero(np.in1d(DATA[select]['x'],times))[0]
-		temp[interval] = [j for j in times_ID]
-		tmin = tmax
-	print('\ntimes DONE in',time.time()-milestone,'seconds')
-	print(select,'has',len([i for i in temp if i!=[]]),'intervals of',FREQ,'with data within the time range\n')
+	with profile_stage(profile,'binning',select):
+		if select in previous:
+			select_sums = update_bin_sums(previous[select],DATA[select]['x'],DATA[select]['y'],t0,time_step,span,start_bins[select])
+		else:
+			select_index = IntervalIndex(DATA[select]['x'],t0,time_step,span) # also used for the statistics
+			select_sums = bin_sums(DATA[select]['x'],DATA[select]['y'],t0,time_step,span,select_index)
+	print('times DONE in',time.time()-milestone,'seconds')
+	print(select,'has',len(select_sums['bin']),'intervals of',FREQ,'with data within the time range\n')
+
+	labels = [label for label in DATA if label != select]+[label for label in previous if (label not in DATA) and (label != select)]
+	results = {}
+	label_stats = {} # bin_stats() of each label
+	if workers is None or workers < 2:
+		for it,label in enumerate(labels):
+			milestone = time.time()
+			progress(it,len(labels),char=label)
+			with profile_stage(profile,'matching',label):
+				index = IntervalIndex(DATA[label]['x'],t0,time_step,span) if label not in previous else None # one index per label for the sums and the statistics
+				results[label] = (match_label(select_sums,DATA.get(label,no_data)['x'],DATA.get(label,no_data)['y'],t0,time_step,span,previous.get(label),start_bins.get(label,0),index),time.time()-milestone)
+			if stats and len(results[label][0][0]):
+				with profile_stage(profile,'statistics',label):
+					label_stats[label] = bin_stats(DATA[label]['x'],DATA[label]['y'],t0,time_step,span,stats,DATA[label].get(err),trim,index)
+	else:
+		from concurrent.futures import ProcessPoolExecutor, as_completed # only needed with workers, python 2 needs the 'futures' backport
+
+		# the times are sent to the workers as int64 microseconds (numpy.datetime64[us]) instead of pickling arrays of datetime objects
+		times = {label:epoch_us(DATA.get(label,no_data)['x']).view('datetime64[us]') for label in labels}
+
+		# the 'select' interval sums are written once to memory-mapped .npy files instead of being pickled with every task
+		select_path = tempfile.mkdtemp(prefix='freq_match_')
+		try:
+			save_bin_sums(select_sums,select_path)
+			with ProcessPoolExecutor(max_workers=workers) as executor:
+				futures = [executor.submit(match_label_worker,label,times[label],DATA.get(label,no_data)['y'],t0,time_step,span,select_path,previous.get(label),start_bins.get(label,0),stats,DATA.get(label,no_data).get(err),trim) for label in labels]
+				for it,future in enumerate(as_completed(futures)):
+					label,result,label_stats[label],elapsed = future.result()
+					progress(it,len(labels),char=label)
+					results[label] = (result,elapsed)
+					if profile is not None:
+						profile.add('matching',elapsed,label)
+		finally:
+			shutil.rmtree(select_path)
+	print('')
+
+	if stats:
+		with profile_stage(profile,'statistics',select):
+			select_stats = bin_stats(DATA[select]['x'],DATA[select]['y'],t0,time_step,span,stats,DATA[select].get(err),trim,select_index)
+
+	# the results are gathered in the order of the labels in DATA, whatever the order in which they were computed
+	for label in labels:
+		(matched_bins,select_means,label_means,label_sums),elapsed = results[label]
+
+		print(label+':\nMatching','intervals of',FREQ,'within the time range: ',len(matched_bins),'/',len(select_sums['bin']))
+		print('Matching and averaging DONE in',elapsed,'seconds\n')
+
+		if len(matched_bins)==0:
+			continue
+
+		if stats:
+			select_means = add_bin_stats(select_means,select_stats,matched_bins)
+			label_means = add_bin_stats(label_means,label_stats[label],matched_bins)
+
+		FREQ_DATA[label] = {} # only keep data with matches
+		FREQ_DATA[label][select] = select_means
+		FREQ_DATA[label][label] = label_means
+
+	with profile_stage(profile,'save'):
+		if save != '':
+			np.save(save,FREQ_DATA)
+
+		if state != '':
+			sums = OrderedDict([(select,select_sums)]+[(label,results[label][0][3]) for label in labels])
+			new_state = {'select':select,'FREQ':FREQ,'t0':t0,'span':span,'sums':sums}
+			save_freq_state(new_state,state)
+
+		if cache_dir != '':
+			if not os.path.isdir(cache_dir):
+				os.makedirs(cache_dir)
+			if state != '':
+				save_freq_state(new_state,cache_path+'_state') # saved before the matches, so that a cached result always has its state
+			save_freq_data(FREQ_DATA,select,cache_path)
+
+	return FREQ_DATA
+
+# microseconds in each time unit of the netCDF 'units' attributes
+cf_time_units = OrderedDict([
+							('microseconds',1),('microsecond',1),('us',1),
+							('milliseconds',10**3),('millisecond',10**3),('msec',10**3),('ms',10**3),
+							('seconds',10**6),('second',10**6),('secs',10**6),('sec',10**6),('s',10**6),
+							('minutes',60*10**6),('minute',60*10**6),('mins',60*10**6),('min',60*10**6),
+							('hours',3600*10**6),('hour',3600*10**6),('hrs',3600*10**6),('hr',3600*10**6),('h',3600*10**6),
+							('days',86400*10**6),('day',86400*10**6),('d',86400*10**6),
+							])
+
+def cf_times(values,units,calendar='standard'):
+	"""
+	- values is a numpy.array of numeric times of a netCDF time variable
+	- units is its 'units' attribute, of the form '<unit> since <date>' e.g. 'seconds since 1970-01-01 00:00:00' or 'days since 2004-01-01'
+	- calendar is its 'calendar' attribute, only the standard (gregorian) calendar is supported
+
+	returns a numpy.datetime64[us] array, the times are converted with numpy without building datetime objects
+	"""
+	if calendar.lower() not in ['standard','gregorian','proleptic_gregorian']:
+		raise ValueError('Invalid calendar: '+calendar+', only the standard calendar is supported')
+
+	try:
+		unit,origin = units.split(' since ')
+		step = cf_time_units[unit.strip().lower()]
+	except (ValueError,KeyError):
+		raise ValueError("Invalid time units: "+units+", must be of the form '<unit> since <date>' e.g. 'seconds since 1970-01-01 00:00:00'")
+
+	# the date is 'YYYY-MM-DD', 'YYYY-MM-DD HH:MM:SS' or 'YYYY-MM-DDTHH:MM:SS', optionally followed by a UTC offset
+	origin = origin.strip().rstrip('Z').split()
+	origin = origin[0].split('T')+origin[1:]
+	date = [int(i) for i in origin[0].split('-')]
+	clock = [float(i) for i in origin[1].split(':')] if len(origin) > 1 else []
+	seconds = sum([value*scale for value,scale in zip(clock,[3600,60,1])])
+	if (len(origin) > 2) and (origin[2].upper() != 'UTC'):
+		offset = origin[2].lstrip('+-')
+		offset = [int(i) for i in (offset.split(':') if ':' in offset else [offset[:-2],offset[-2:]] if len(offset) > 2 else [offset])]
+		seconds -= (-1 if origin[2].startswith('-') else 1)*sum([value*scale for value,scale in zip(offset,[3600,60])])
+	origin_us = np.datetime64('{:04d}-{:02d}-{:02d}'.format(*date),'us').astype(np.int64)+int(round(seconds*10**6))
+
+	values = np.asarray(values)
+	if values.dtype.kind in 'iu':
+		x = values.astype(np.int64)*step
+	else:
+		x = np.rint(values.astype(np.float64)*step).astype(np.int64)
+
+	return (x+origin_us).astype('datetime64[us]')
+
+def netcdf_blocks(files,label,value_var,time_var='time',chunk_size=100000):
+	"""
+	generator of (label,x,y) blocks read sequentially from netCDF files, to be used with freq_match_stream()
+
+	- files is a list of paths to netCDF files with data of 'label'
+	- value_var is the name of the netCDF variable with the y values
+	- time_var is the name of the netCDF time variable, it must have a 'units' attribute of the form '<unit> since <date>' (e.g. 'seconds since 1970-01-01 00:00:00' or 'days since 2004-01-01'), see cf_times()
+	- chunk_size is the number of elements read at once
+
+	the times are numpy.datetime64[us] and masked values are skipped
+	"""
+	import netCDF4 # only needed to read netCDF files
+
+	for path in files:
+		dataset = netCDF4.Dataset(path,'r')
+		try:
+			times = dataset.variables[time_var]
+			values = dataset.variables[value_var]
+			time_calendar = getattr(times,'calendar','standard')
+			for start in range(0,len(times),chunk_size):
+				y = values[start:start+chunk_size]
+				valid = ~np.ma.getmaskarray(y)
+				x = cf_times(np.ma.getdata(times[start:start+chunk_size])[valid],times.units,time_calendar)
+				yield label,x,np.ma.getdata(y)[valid]
+		finally:
+			dataset.close()
+
+def freq_match_stream(blocks,select,FREQ,date_range,save=''):
+	"""
+	same as freq_match() but the data is read block by block, only the sums of data in each interval of FREQ are kept in memory and the full time series are never held at once
+
+	- blocks is an iterable of (label,x,y) tuples, each with a chunk of the x (datetime) and y values of 'label' (e.g. netcdf_blocks(), or several of them chained with itertools.chain)
+		- the blocks of different labels can come in any order
+	- date_range must be specified since the time range of the data is not known in advance
+	- select, FREQ and save are the same as in freq_match()
+
+	returns the same dictionary as freq_match()
+	"""
+	t0 = parse_date(date_range[0])
+	tf = parse_date(date_range[1])
+	if (t0 is None) or (tf is None):
+		print("Invalid input")
+		return "Invalid input: date_range must be of the form ['YYY-MM-DD-HH','YYY-MM-DD-HH']"
+	if tf < t0:
+		print("The starting date shall precede the end date")
+		return 'Invalid input: date_range[1] < date_range[0]'
+
+	time_step = parse_freq(FREQ)
+
+	span = int(ceil((tf-t0).total_seconds()/time_step.total_seconds()))
+
+	milestone = time.time()
+	print('Reading and dividing the data in',span,'intervals of',FREQ)
+	parts = OrderedDict() # interval sums of each block, for each label
+	it = 0
+	for label,x,y in blocks:
+		parts.setdefault(label,[]).append(bin_sums(x,y,t0,time_step,span))
+		# merge the blocks once in a while so that memory use is bounded by the number of intervals
+		if len(parts[label]) >= 100:
+			parts[label] = [merge_bin_sums(parts[label])]
+		it += 1
+		sys.stdout.write('\r'+str(it)+' blocks read. Data: '+label+'                    ')
+		sys.stdout.flush()
+	print('\nblocks DONE in',time.time()-milestone,'seconds')
+
+	sums = OrderedDict([(label,merge_bin_sums(parts[label])) for label in parts])
+
+	if select not in sums:
+		print(select,'has no data')
+		return 'Invalid input: no block with data of '+select
+
+	print(select,'has',len(sums[select]['bin']),'intervals of',FREQ,'with data within the time range\n')
+
+	FREQ_DATA = {}
+	for label in sums:
+		if label == select:
+			continue
 
+		matched_bins,select_means,label_means = match_sums(sums[select],sums[label])
+
+		print(label+':\nMatching','intervals of',FREQ,'within the time range: ',len(matched_bins),'/',len(sums[select]['bin']))
+
+		if len(matched_bins)==0:
+			continue
+
+		FREQ_DATA[label] = {} # only keep data with matches
+		FREQ_DATA[label][select] = select_means
+		FREQ_DATA[label][label] = label_means
+
+	if save != '':
+		np.save(save,FREQ_DATA)
+
+	return FREQ_DATA
+
+def window_ids(select_t,label_t,tol):
+	"""
+	- select_t and label_t are sorted int64 numpy.arrays of times in microseconds since 1970-01-01 (see epoch_us())
+	- tol is the half width of the coincidence window in microseconds
+
+	returns (first,last,nearest) int64 numpy.arrays with one element per time of select_t:
+		- the label times within +/- tol of select_t[i] are label_t[first[i]:last[i]], there are none if first[i] == last[i]
+		- nearest[i] is the index of the label time closest to select_t[i] (the earliest one if two are equally close)
+
+	both arrays are sorted so each window is found with a binary search, the cost is O((N+M) log M)
+	"""
+	first = np.searchsorted(label_t,select_t-tol,side='left')
+	last = np.searchsorted(label_t,select_t+tol,side='right')
+
+	# the closest label time is either the first one at or after select_t[i] or the one before it
+	after = np.searchsorted(label_t,select_t,side='left')
+	before = np.maximum(after-1,0)
+	after = np.minimum(after,len(label_t)-1)
+	nearest = np.where(np.abs(label_t[after]-select_t) < np.abs(select_t-label_t[before]),after,before)
+
+	return first,last,nearest
+
+def tolerance_match(DATA,select,tolerance,date_range=[None,None],average=False,save=''):
+	"""
+	coincidence matching without intervals: each 'select' data is paired with the label data within +/- tolerance of its time
+
+	- DATA and select are the same as in freq_match()
+	- tolerance is the half width of the coincidence window, of the same form as FREQ in freq_match() (e.g. '30 minutes' or '1 hours')
+	- date_range is the same as in freq_match(), if not specified all the 'select' data is used
+	- average:
+		- if False, each 'select' data is paired with the closest label data within the window
+		- if True, each 'select' data is paired with the average time and value of all the label data within the window
+	- save is the same as in freq_match()
+
+	the same label data can be paired with several 'select' data that are less than 2*tolerance apart
+	returns the same dictionary as freq_match(), to be used in bok_comp()
+	"""
+	tol = parse_freq(tolerance)
+	tol = tol.days*86400*10**6+tol.seconds*10**6+tol.microseconds
+
+	select_t = epoch_us(DATA[select]['x'])
+	select_y = np.asarray(DATA[select]['y'],dtype=np.float64)
+	order = np.argsort(select_t,kind='mergesort')
+	select_t = select_t[order]
+	select_y = select_y[order]
+
+	if None not in date_range:
+		t0 = parse_date(date_range[0])
+		tf = parse_date(date_range[1])
+		if (t0 is None) or (tf is None):
+			print("Invalid input")
+			return "Invalid input: date_range must be of the form ['YYY-MM-DD-HH','YYY-MM-DD-HH']"
+		if tf < t0:
+			print("The starting date shall precede the end date")
+			return 'Invalid input: date_range[1] < date_range[0]'
+		inside = (select_t >= epoch_us([t0])[0]) & (select_t < epoch_us([tf])[0])
+		select_t = select_t[inside]
+		select_y = select_y[inside]
+
+	print(select,'has',len(select_t),'data within the time range, matched within +/-',tolerance,'\n')
+
+	FREQ_DATA = {}
 	for label in DATA:
-		if label != select:
-			freq_label_data = {}
-			freq_select_data = {}
+		if label == select:
+			continue
 
-			milestone = time.time()
-			print(label+':\nMatching and averaging:')
-			tmin = t0
-			temp1 = [[] for i in range(span)]
-			# this loop can be very time consuming if the frequency of matching/averaging is small
-			for interval in range(span):
-				progress(interval,span,char=label)
-				tmax=tmin+time_step
-				if len(temp[interval])>0:
-					times = DATA[label]['x'][(DATA[label]['x'] >= tmin) & (DATA[label]['x'] < tmax)]
-					if len(times)>0:
-						times_ID = np.nonzero(np.in1d(DATA[label]['x'],times))[0]
-						temp1[interval] = [j for j in times_ID]
-					else:
-						temp1[interval] = []
-				else:
-					temp1[interval] = []
-				tmin=tmax
-			try:
-				if len([i for i in temp1 if i!=[]])==0:
-					print('\nmatching DONE in',time.time()-milestone,'seconds')
-					print('Matching intervals of',FREQ,'within the time range: 0 /',len([i for i in temp if i!=[]]))
-					continue
-			except NameError:
-				print('\n',label,' has no data within the time range\n')
-				continue
+		milestone = time.time()
 
-			FREQ_DATA[label] = {} # only keep data with matches
+		label_t = epoch_us(DATA[label]['x'])
+		label_y = np.asarray(DATA[label]['y'],dtype=np.float64)
+		order = np.argsort(label_t,kind='mergesort')
+		label_t = label_t[order]
+		label_y = label_y[order]
 
-			tp=[i for i in temp if i!=[] and temp1[temp.index(i)]!=[]] # Matching indices for data in DATA[select]
-			tp1=[i for i in temp1 if i!=[] and temp[temp1.index(i)]!=[]] # Matching indices for data in DATA[label]
+		if len(label_t)==0:
+			continue
 
-			if len(tp)!=len(tp1):
-				print('WARNING: length of matches is different: tp1=',len(tp1),'; tp=',len(tp))
+		first,last,nearest = window_ids(select_t,label_t,tol)
+		matched = last > first
 
-	
-			freq_select_data['y'] = np.array([sum([DATA[select]['y'][j] for j in i])/len(i) for i in tp])
-			freq_label_data['y'] = np.array([sum([DATA[label]['y'][j] for j in i])/len(i) for i in tp1])
+		print(label+':\nMatching data within +/-',tolerance,': ',np.count_nonzero(matched),'/',len(select_t))
 
-			# the time range is divided in intervals of FREQ, but the data isn't necessarily evenly distributed in time in each intervals, thus I use the average time of the data in each interval
-			try:
-				freq_select_data['x'] = np.array([datetime(*time.gmtime(sum([calendar.timegm(DATA[select]['x'][j].timetuple()) for j in i])/len(i))[:6]) for i in tp])
-				freq_label_data['x'] = np.array([datetime(*time.gmtime(sum([calendar.timegm(DATA[label]['x'][j].timetuple()) for j in i])/len(i))[:6]) for i in tp1])
-			except IndexError:
-				print('Index error for',label
-				)
-			print('\nMatching','intervals of',FREQ,'within the time range: ',len(tp),'/',len([i for i in temp if i!=[]]))
+		if not np.any(matched):
+			continue
+
+		first = first[matched]
+		last = last[matched]
+		count = last-first
+
+		if average:
+			# window sums from cumulative sums, the times are summed relative to the first label time to keep their precision
+			cum_t = np.concatenate(([0.0],np.cumsum((label_t-label_t[0])/1e6)))
+			cum_y = np.concatenate(([0.0],np.cumsum(label_y)))
+			label_x = label_t[0]+np.round((cum_t[last]-cum_t[first])/count*1e6).astype(np.int64)
+			label_mean = (cum_y[last]-cum_y[first])/count
+		else:
+			label_x = label_t[nearest[matched]]
+			label_mean = label_y[nearest[matched]]
 
-			print('Matching and averaging DONE in',time.time()-milestone,'seconds\n')
+		print('Matching DONE in',time.time()-milestone,'seconds\n')
 
-			FREQ_DATA[label][select] = freq_select_data
-			FREQ_DATA[label][label] = freq_label_data
+		FREQ_DATA[label] = {} # only keep data with matches
+		FREQ_DATA[label][select] = {'x':select_t[matched].astype('datetime64[us]').astype('datetime64[ms]'),'y':select_y[matched]}
+		FREQ_DATA[label][label] = {'x':label_x.astype('datetime64[us]').astype('datetime64[ms]'),'y':label_mean}
 
 	if save != '':
 		np.save(save,FREQ_DATA)
 
 	return FREQ_DATA
 
+def freq_bin(DATA,FREQ,date_range=[None,None],select=None):
+	"""
+	bin the data of every label once in the same intervals of FREQ, so that all the labels can be compared with each other (see pair_data(), pair_stats() and bok_matrix())
+
+	- DATA is the same dictionary as in freq_match()
+	- date_range and FREQ are the same as in freq_match(), if date_range is not specified it goes from the earliest to the latest data of all the labels
+	- select is one of the labels, if given and date_range is not specified the intervals are the same as in freq_match(DATA,select,FREQ) (from the first to the last data of select)
+
+	returns an OrderedDict {'label':{'bin':[...],'x':[...],'y':[...]},...} with the interval numbers that have data, and the average time (numpy.datetime64[ms]) and value of the data in each of them
+	"""
+	if (None in date_range) and (select is not None):
+		t0 = as_datetime(DATA[select]['x'][0])
+		tf = as_datetime(DATA[select]['x'][-1])
+	elif None in date_range:
+		t0 = as_datetime(min([np.min(as_datetime64(DATA[label]['x'])) for label in DATA if len(DATA[label]['x'])]))
+		tf = as_datetime(max([np.max(as_datetime64(DATA[label]['x'])) for label in DATA if len(DATA[label]['x'])]))
+	else:
+		t0 = parse_date(date_range[0])
+		tf = parse_date(date_range[1])
+		if (t0 is None) or (tf is None):
+			print("Invalid input")
+			return "Invalid input: date_range must be of the form ['YYY-MM-DD-HH','YYY-MM-DD-HH']"
+		if tf < t0:
+			print("The starting date shall precede the end date")
+			return 'Invalid input: date_range[1] < date_range[0]'
+
+	time_step = parse_freq(FREQ)
+
+	# +1 so that the latest data is in the last interval when date_range and select are not specified
+	span = int(ceil((tf-t0).total_seconds()/time_step.total_seconds()))+int((None in date_range) and (select is None))
+
+	print('Dividing the time range in',span,'intervals of',FREQ)
+	BIN_DATA = OrderedDict()
+	for it,label in enumerate(DATA):
+		progress(it,len(DATA),char=label)
+		sums = bin_sums(DATA[label]['x'],DATA[label]['y'],t0,time_step,span)
+		BIN_DATA[label] = bin_means(sums,sums['bin'])
+		BIN_DATA[label]['bin'] = sums['bin']
+	print('')
+
+	return BIN_DATA
+
+def pair_data(BIN_DATA,label,ref):
+	"""
+	- BIN_DATA is the dictionary returned by freq_bin()
+	- label and ref are two of its labels
+
+	returns the dictionary that freq_match(DATA,ref,...) would give for 'label', {label:{label:{'x':[...],'y':[...]},ref:{'x':[...],'y':[...]}}}, to be used in bok_comp()
+	the intervals with data from both labels are found with one intersection of their sorted interval numbers, nothing is binned again
+	"""
+	matched_bins,label_ids,ref_ids = np.intersect1d(BIN_DATA[label]['bin'],BIN_DATA[ref]['bin'],assume_unique=True,return_indices=True)
+
+	return {label:{
+					label:{'x':BIN_DATA[label]['x'][label_ids],'y':BIN_DATA[label]['y'][label_ids]},
+					ref:{'x':BIN_DATA[ref]['x'][ref_ids],'y':BIN_DATA[ref]['y'][ref_ids]},
+					}}
+
+def pair_stats(BIN_DATA):
+	"""
+	- BIN_DATA is the dictionary returned by freq_bin()
+
+	returns a dictionary with the statistics between all the pairs of labels of BIN_DATA:
+		- 'labels' is the list of labels
+		- 'N','RMS','Bias','Scatter','R' are (number of labels x number of labels) numpy.arrays, the element [i,j] is for the differences labels[i]-labels[j] of the coincident data, as in the table of bok_comp()
+		- the statistics are NaN when two labels have less than 2 coincident intervals
+	"""
+	labels = list(BIN_DATA.keys())
+	n_labels = len(labels)
+
+	stats = {'labels':labels,'N':np.zeros((n_labels,n_labels),dtype=np.int64)}
+	for key in ['RMS','Bias','Scatter','R']:
+		stats[key] = np.full((n_labels,n_labels),np.nan)
+
+	for i,label in enumerate(labels):
+		for j in range(i,n_labels):
+			pair = pair_data(BIN_DATA,label,labels[j])[label]
+			y1 = pair[label]['y']
+			y2 = pair[labels[j]]['y']
+			N = len(y1)
+			stats['N'][i,j] = stats['N'][j,i] = N
+			if N < 2:
+				continue
+
+			diff = y1-y2
+			stats['Bias'][i,j] = diff.mean()
+			if j != i:
+				stats['Bias'][j,i] = -stats['Bias'][i,j]
+			stats['RMS'][i,j] = stats['RMS'][j,i] = np.sqrt(np.mean(diff**2))
+			stats['Scatter'][i,j] = stats['Scatter'][j,i] = diff.std(ddof=1)
+			with np.errstate(divide='ignore',invalid='ignore'):
+				stats['R'][i,j] = stats['R'][j,i] = np.corrcoef(y1,y2)[0,1]
+
+	return stats
+
 ###############################################################################################################################
 ###############################################################################################################################
 
 # plot time series
-def bok_series(DATA,xlab='',ylab='',sup_title='',notes=''):
+def write_sidecar(data,path):
+	"""
+	write the numeric columns of one time series in a binary file for the lazy loading of bok_series()
+
+	- data is a dictionary {'x':[...],'y':[...],...} of one time series
+	- path is the full path to the file
+
+	the columns are written one after the other as little-endian float64, 'x' in milliseconds since 1970-01-01 like bokeh does
+	returns the list of the names of the columns in the file
+	"""
+	columns = datetime64_columns(data)
+	names = [key for key in columns if np.asarray(columns[key]).dtype.kind in 'biufM']
+
+	with open(path,'wb') as outfile:
+		for key in names:
+			values = np.asarray(columns[key])
+			if values.dtype.kind == 'M':
+				values = values.astype('datetime64[ms]').astype(np.int64)
+			outfile.write(values.astype('<f8').tobytes())
+
+	return names
+
+# javascript code of the bok_series() checkboxes that fetches the sidecar file of each checked label the first time, 'lazy' is a list of {'source':...,'url':...,'columns':[...],'length':...}
+# if the fetch fails (e.g. missing file, or a page opened from file://) the error is logged in the console and the label is fetched again the next time it is checked
+lazy_load_js = """
+	for (var i=0; i<lazy.length; i++) {
+		if (!checkbox.active.includes(i) || (lazy[i] === null) || lazy[i]['source'].loading) {continue;}
+		lazy[i]['source'].loading = true;
+		(function(spec) {
+			fetch(spec['url']).then(function(response) {
+				if (!response.ok) {throw new Error('HTTP status '+response.status);}
+				return response.arrayBuffer();
+			}).then(function(buffer) {
+				var values = new Float64Array(buffer);
+				var data = {};
+				for (var k=0; k<spec['columns'].length; k++) {data[spec['columns'][k]] = values.subarray(k*spec['length'],(k+1)*spec['length']);}
+				spec['source'].data = data;
+			}).catch(function(error) {
+				spec['source'].loading = false;
+				console.error('Could not load '+spec['url']+': '+error);
+			});
+		})(lazy[i]);
+	}
+	"""
+
+def bok_series(DATA,xlab='',ylab='',sup_title='',notes='',lod=False,lod_points=2000,active=None,sidecar='',sidecar_url='',server=False):
 	"""
 	the DICTIONARY (or OrderedDict) DATA must be of the form:
 
@@ -692,6 +2501,7 @@ def bok_series(DATA,xlab='',ylab='',sup_title='',notes=''):
 		 }
 
 	if colors are not specified, the kelly_color dictionary will be used
+	the times 'x' can be datetime objects or numpy.datetime64, they are formatted by the browser in the hover tool
 
 	There will be a figure, and one "notes" text widget.
 	The main figure will show all the time series
@@ -700,21 +2510,31 @@ def bok_series(DATA,xlab='',ylab='',sup_title='',notes=''):
 		- 'ylab' is the label of the y axis
 		- 'sup_title' is the header of the html page
 		- 'notes' is a string of html code that will be displayed in a text widget beside the plots
+		- 'lod' if True, the time series are displayed with a level of detail that depends on the zoom (see lod_display())
+		- 'lod_points' with lod=True, the maximum number of points displayed per time series
+		- 'active' is the list of labels checked when the page opens, all the labels by default
+		- 'sidecar' is the path to a directory where the data of the labels that are not in 'active' is written in binary files (see write_sidecar()) instead of being embedded in the page
+			- the page fetches the file of a label the first time its checkbox is checked, from 'sidecar_url' (by default the name of the 'sidecar' directory, relative to the html file)
+			- browsers don't fetch files from a page opened from the disk, the html file and the sidecar directory must be served (e.g. with python -m SimpleHTTPServer)
+			- if a file can't be fetched the error is shown in the browser console and the file is fetched again the next time the label is checked
+			- only the numeric columns are written, and the labels that are not in 'active' are not displayed with a level of detail
+		- 'server' if True with 'active', the data of the labels that are not in 'active' is sent by the bokeh server the first time their checkbox is checked, to be used in a bokeh server app
 	"""
 
-	######## /!\ important time handling to make sure times don't get shifted from UTC due to computer environment variables when using datetime objects ###########
-	os.environ['TZ'] = 'UTC'
-	time.tzset()
-	# This will not change your system timezone settings
-	################################################################################################################################################################
-
 	for label in DATA:
 		try:
 			test = DATA[label]['color']
 		except KeyError:
 			DATA[label]['color'] = kelly_colors[kelly_colors.keys()[DATA.keys().index(label)]]
 
-		DATA[label]['nicetime'] = [dat.strftime('%d-%m-%Y %H:%M:%S') for dat in DATA[label]['x']]
+	if active is None:
+		active = list(DATA.keys())
+
+	# labels whose data is only loaded when they are checked
+	if (sidecar != '') or server:
+		lazy_labels = [label for label in DATA if label not in active]
+	else:
+		lazy_labels = []
 
 
 	if sup_title == '':
@@ -723,13 +2543,25 @@ def bok_series(DATA,xlab='',ylab='',sup_title='',notes=''):
 	header = Div(text=sup_title,width=700) # the title of the dashboard
 
 	sources = {} # data sources for the main figure
-	for label in DATA:
-		sources[label] = ColumnDataSource(data={key:DATA[label][key] for key in DATA[label] if key!='color'}) # 'label' data
-
-	#get the min and max of all the data x and y
-	min_x = min([DATA[label]['x'][0] for label in DATA])
-	max_x = max([DATA[label]['x'][-1] for label in DATA])
-
+	lazy = [] # how to load the data of each label in the browser, None for the data embedded in the page
+	if (sidecar != '') and lazy_labels and not os.path.isdir(sidecar):
+		os.makedirs(sidecar)
+	for it,label in enumerate(DATA):
+		if label not in lazy_labels:
+			sources[label] = ColumnDataSource(data=datetime64_columns({key:DATA[label][key] for key in DATA[label] if key!='color'})) # 'label' data
+			lazy.append(None)
+			continue
+
+		sources[label] = ColumnDataSource(data={'x':[],'y':[]}) # filled when the label is checked
+		if server:
+			lazy.append(None)
+			continue
+
+		file_name = 'series_'+str(it)+'.bin'
+		columns = write_sidecar({key:DATA[label][key] for key in DATA[label] if key!='color'},os.path.join(sidecar,file_name))
+		lazy.append({'source':sources[label],'url':'/'.join([(sidecar_url or os.path.basename(os.path.normpath(sidecar))).rstrip('/'),file_name]),'columns':columns,'length':len(DATA[label]['x'])})
+
+	#get the min and max of all the data y
 	min_y = min([min(abs(DATA[label]['y'])) for label in DATA])
 	max_y = max([max(DATA[label]['y']) for label in DATA])
 
@@ -744,16 +2576,23 @@ def bok_series(DATA,xlab='',ylab='',sup_title='',notes=''):
 	fig = figure(output_backend="webgl", plot_width=900,plot_height=200+20*(len(DATA.keys())-2),tools=TOOLS,x_axis_type='datetime', y_range=[min_y,max_y],toolbar_location='left') # figure with the time series
 
 	# actual time series
+	series_sources = [sources[label] for label in DATA]
+	if lod:
+		# the labels loaded later are displayed at full resolution
+		lod_sources = iter(lod_display(fig,[sources[label] for label in DATA if label not in lazy_labels],lod_points))
+		series_sources = [sources[label] if label in lazy_labels else next(lod_sources) for label in DATA]
+
 	plots = []
-	for label in DATA:
-		plots.append( fig.scatter(x='x',y='y',color=DATA[label]['color'],alpha=0.5,source=sources[label]) )
+	for it,label in enumerate(DATA):
+		plots.append( fig.scatter(x='x',y='y',color=DATA[label]['color'],alpha=0.5,source=series_sources[it],visible=label in active) )
 
-	# hover tool configuration
+	# hover tool configuration, the times are formatted by the browser
 	fig.select_one(HoverTool).tooltips = [
 		('index','$index'),
 	    ('y','@y'),
-	    ('x','@nicetime'),
+	    ('x','@x{%d-%m-%Y %H:%M:%S}'),
 	]
+	fig.select_one(HoverTool).formatters = {'x':'datetime'}
 
 	N_plots = range(len(plots)) # used in the checkbox callbacks
 
@@ -763,15 +2602,33 @@ def bok_series(DATA,xlab='',ylab='',sup_title='',notes=''):
 	fig.yaxis.axis_label = ylab
 	fig.xaxis.axis_label = xlab
 
-	checkbox = CheckboxGroup(labels=DATA.keys(),active=range(len(DATA.keys())),width=100) # the group of checkboxes, one for each 'label' in DATA
+	checkbox = CheckboxGroup(labels=DATA.keys(),active=[i for i,label in enumerate(DATA) if label in active],width=100) # the group of checkboxes, one for each 'label' in DATA
 
 	iterable = [('p'+str(i),plots[i]) for i in N_plots]+[('checkbox',checkbox)] # associate each element needed in the callback to a string
 
 	# checkboxes to trigger line visibility
 	checkbox_iterable = [('p'+str(i),plots[i]) for i in N_plots]+[('checkbox',checkbox)]
 	checkbox_code = ''.join(['p'+str(i)+'.visible = checkbox.active.includes('+str(i)+');' for i in N_plots])
+	# the sidecar files of the checked labels are fetched the first time they are checked
+	if any([spec is not None for spec in lazy]):
+		checkbox_iterable += [('lazy'+str(i),lazy[i]['source']) for i in N_plots if lazy[i] is not None]
+		lazy_specs = [None if lazy[i] is None else {'url':lazy[i]['url'],'columns':lazy[i]['columns'],'length':lazy[i]['length']} for i in N_plots]
+		checkbox_code += """
+	var lazy = """+json.dumps(lazy_specs)+""";
+	var lazy_sources = ["""+','.join(['null' if lazy[i] is None else 'lazy'+str(i) for i in N_plots])+"""];
+	for (var i=0; i<lazy.length; i++) {if (lazy[i] !== null) {lazy[i]['source'] = lazy_sources[i];}}
+	"""+lazy_load_js
 	checkbox.callback = CustomJS(args={key: value for key,value in checkbox_iterable}, code=checkbox_code)
 
+	# with the bokeh server, the data of a label is sent the first time it is checked
+	if server and lazy_labels:
+		labels = list(DATA.keys())
+		def load_labels(attr,old,new):
+			for i in new:
+				if (labels[i] in lazy_labels) and (len(sources[labels[i]].data['x']) == 0):
+					sources[labels[i]].data = datetime64_columns({key:DATA[labels[i]][key] for key in DATA[labels[i]] if key!='color'})
+		checkbox.on_change('active',load_labels)
+
 	# button to uncheck all checkboxes
 	clear_button = Button(label='Clear all',width=120)
 	clear_button_code = """checkbox.active=[];"""+checkbox_code
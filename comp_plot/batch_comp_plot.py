@@ -0,0 +1,247 @@
+#!/var/lib/py27_sroche/bin/python
+ # -*- coding: ascii -*-
+
+from __future__ import print_function # allows the use of Python 3.x print(function in python 2.x code so that print('a','b') prints 'a b' and not ('a','b')
+
+####################
+# code description #
+####################
+
+"""
+Build several bok_comp() dashboards from a list of jobs
+
+usage:
+python batch_comp_plot.py jobs.json [workers]
+
+	- jobs.json is a JSON file (or a YAML file ending in .yaml/.yml if PyYAML is installed) of the form:
+	{
+		"datasets": {
+					"xco2": "TCCON_sample_data_xco2",
+					"xch4": "TCCON_sample_data_xch4.npy"
+					},
+		"jobs": [
+				{"data":"xco2", "select":"Lamont", "FREQ":"1 days", "date_range":["2015-01-01","2016-01-01"], "save":"xco2_lamont_daily.html"},
+				{"data":"xco2", "select":"Park Falls", "FREQ":"1 days", "date_range":["2015-01-01","2016-01-01"], "labels":["Lamont","Orleans"], "save":"xco2_parkfalls_daily.html"},
+				{"freq_data":"TCCON_sample_data_co2_freq_1_days", "select":"Lamont", "save":"TCCON_XCO2.html", "ylab":"XCO2 (ppm)"}
+				]
+	}
+
+	- "datasets" are the paths to DATA dictionaries like those given to freq_match(), saved with save_columns() or pickled in a .npy file
+	- each job makes one html file "save", the other keys of a job are optional:
+		- "data" is the name of a dataset to match with "select", "FREQ" and "date_range" (required with "data") like in freq_match(), "date_range" can be [null,null]
+		- "freq_data" is the path to already matched data like the one returned by freq_match(), instead of "data"
+		- "labels" is the list of labels compared with "select", all the other labels of the dataset by default, they must all be in the dataset
+		- "title", "notes", "xlab", "ylab", "prec" are given to bok_comp() ("title" is its 'sup_title')
+		- "tab", "binary", "compress" are given to write_html()
+	- workers is the number of processes used to build the html files, 1 by default
+
+Each dataset (and each "freq_data" file) is loaded once, and the jobs with the same dataset, FREQ and date_range share the same binning:
+the data of each label is binned once with freq_bin(), and the coincident data of each job is taken from it with pair_data() (the same result as freq_match()).
+With a date_range of [null,null] the intervals depend on the data of "select", so only the jobs with the same "select" share the binning.
+"""
+
+####################
+# import libraries #
+####################
+
+import os
+import sys
+import json
+import time
+
+from collections import OrderedDict
+
+# special arrays with special functions
+import numpy as np
+
+# generic functions to build a html dashboard to compare time series.
+from BOKEH_comp_plot import *
+
+#############
+# Functions #
+#############
+
+def load_jobs(path):
+	"""
+	returns the dictionary {'datasets':{...},'jobs':[...]} of a JSON or YAML job file
+	"""
+	with open(path,'r') as infile:
+		if path.endswith('.yaml') or path.endswith('.yml'):
+			import yaml # only needed for YAML job files
+			jobs = yaml.safe_load(infile)
+		else:
+			jobs = json.load(infile,object_pairs_hook=OrderedDict)
+
+	jobs.setdefault('datasets',{})
+
+	return jobs
+
+def load_dataset(path):
+	"""
+	returns the dictionary saved with save_columns() at 'path', or pickled in 'path' if it ends with '.npy'
+	"""
+	if path.endswith('.npy'):
+		return np.load(path,allow_pickle=True,encoding='latin1').item()
+
+	return load_columns(path)
+
+def check_job(job,datasets):
+	"""
+	returns an error message if the job is invalid, or '' if it is valid
+	"""
+	if 'save' not in job:
+		return 'the job has no "save" path'
+	if 'select' not in job:
+		return 'the job has no "select" label'
+	if ('data' in job) == ('freq_data' in job):
+		return 'the job must have either "data" or "freq_data"'
+	if 'data' in job:
+		if job['data'] not in datasets:
+			return 'the dataset '+job['data']+' is not in "datasets"'
+		if ('FREQ' not in job) or ('date_range' not in job):
+			return 'the jobs with "data" need "FREQ" and "date_range"'
+		try:
+			valid_freq = parse_freq(job['FREQ']).total_seconds() > 0
+		except (ValueError,TypeError):
+			valid_freq = False
+		if not valid_freq:
+			return 'the FREQ '+str(job['FREQ'])+" must be of the form '1 hours' or '2.3 days' or '7.21 weeks'"
+		if (not isinstance(job['date_range'],list)) or (len(job['date_range']) != 2):
+			return 'the date_range must be a list of two dates'
+		if None not in job['date_range']:
+			try:
+				t0,tf = [parse_date(date) for date in job['date_range']]
+			except (ValueError,TypeError):
+				t0,tf = None,None
+			if (t0 is None) or (tf is None):
+				return "the date_range must be of the form ['YYYY-MM-DD-HH','YYYY-MM-DD-HH'] or ['YYYY-MM-DD','YYYY-MM-DD']"
+			if tf < t0:
+				return 'the end of the date_range precedes its start'
+
+	return ''
+
+def job_data(jobs):
+	"""
+	- jobs is the dictionary returned by load_jobs()
+
+	returns a list with the data to give to bok_comp() for each job, or an error message for the invalid jobs
+	each dataset and "freq_data" file is loaded once, and each dataset is binned once for each FREQ and date_range
+	"""
+	datasets = {}
+	freq_datasets = {} # "freq_data" files already loaded, by path
+	binned = {} # freq_bin() output for each (dataset,FREQ,date_range), and select if date_range is not specified
+	FREQ_DATA_list = []
+	for it,job in enumerate(jobs['jobs']):
+		error = check_job(job,jobs['datasets'])
+		if error != '':
+			print('Invalid job',it,':',error)
+			FREQ_DATA_list.append('Invalid input: '+error)
+			continue
+
+		if 'freq_data' in job:
+			if job['freq_data'] not in freq_datasets:
+				freq_datasets[job['freq_data']] = load_dataset(job['freq_data'])
+			FREQ_DATA = freq_datasets[job['freq_data']]
+			labels = job.get('labels',list(FREQ_DATA.keys()))
+			missing = [label for label in labels if label not in FREQ_DATA]
+			if missing:
+				print('Invalid job',it,': labels not in',job['freq_data'])
+				FREQ_DATA_list.append('Invalid input: the labels '+', '.join(missing)+' are not in '+job['freq_data'])
+				continue
+			FREQ_DATA_list.append(OrderedDict([(label,FREQ_DATA[label]) for label in labels]))
+			continue
+
+		if job['data'] not in datasets:
+			milestone = time.time()
+			datasets[job['data']] = load_dataset(jobs['datasets'][job['data']])
+			print('Loaded',job['data'],'in',time.time()-milestone,'seconds')
+		DATA = datasets[job['data']]
+
+		missing = [label for label in [job['select']]+job.get('labels',[]) if label not in DATA]
+		if missing:
+			print('Invalid job',it,': labels not in',job['data'])
+			FREQ_DATA_list.append('Invalid input: the labels '+', '.join(missing)+' are not in the dataset '+job['data'])
+			continue
+
+		# without date_range the intervals start at the first data of select, like in freq_match()
+		select = job['select'] if None in job['date_range'] else None
+		key = (job['data'],job['FREQ'],tuple(job['date_range']),select)
+		if key not in binned:
+			milestone = time.time()
+			binned[key] = freq_bin(DATA,job['FREQ'],job['date_range'],select)
+			print('Binned',job['data'],'in intervals of',job['FREQ'],'in',time.time()-milestone,'seconds')
+		BIN_DATA = binned[key]
+		if isinstance(BIN_DATA,str):
+			FREQ_DATA_list.append(BIN_DATA)
+			continue
+
+		FREQ_DATA = OrderedDict()
+		for label in job.get('labels',[label for label in DATA if label != job['select']]):
+			pair = pair_data(BIN_DATA,label,job['select'])
+			if len(pair[label][label]['x']): # only keep data with matches
+				FREQ_DATA.update(pair)
+		FREQ_DATA_list.append(FREQ_DATA)
+
+	return FREQ_DATA_list
+
+def render_job(job,FREQ_DATA):
+	"""
+	write the html file of one job, returns (save path,time spent in seconds)
+	"""
+	milestone = time.time()
+
+	grid = bok_comp(
+					FREQ_DATA,
+					job['select'],
+					xlab=job.get('xlab',''),
+					ylab=job.get('ylab',''),
+					sup_title=job.get('title',''),
+					notes=job.get('notes',''),
+					prec=str(job.get('prec','2')),
+					)
+
+	write_html(grid,tab=job.get('tab','bokeh'),save=job['save'],binary=job.get('binary',False),compress=job.get('compress',False))
+
+	return job['save'],time.time()-milestone
+
+#############
+# Main code #
+#############
+
+if __name__ == "__main__":
+
+	argu = sys.argv
+
+	try:
+		jobs_path = argu[1]
+	except IndexError:
+		print('Missing argument: need the path to a JSON file with the list of jobs')
+		sys.exit()
+
+	workers = int(argu[2]) if len(argu) > 2 else 1
+
+	start = time.time()
+
+	jobs = load_jobs(jobs_path)
+
+	FREQ_DATA_list = job_data(jobs)
+
+	valid = [(job,FREQ_DATA) for job,FREQ_DATA in zip(jobs['jobs'],FREQ_DATA_list) if not isinstance(FREQ_DATA,str)]
+
+	print('\nBuilding',len(valid),'html files with',workers,'processes')
+	if workers < 2:
+		for it,(job,FREQ_DATA) in enumerate(valid):
+			save,elapsed = render_job(job,FREQ_DATA)
+			print(it+1,'/',len(valid),save,'DONE in',elapsed,'seconds')
+	else:
+		# parallel processing (python 2 needs the 'futures' backport)
+		from concurrent.futures import ProcessPoolExecutor, as_completed
+
+		# each process imports bokeh once and builds several dashboards, only the matched data is sent to it
+		with ProcessPoolExecutor(max_workers=workers) as executor:
+			futures = [executor.submit(render_job,job,FREQ_DATA) for job,FREQ_DATA in valid]
+			for it,future in enumerate(as_completed(futures)):
+				save,elapsed = future.result()
+				print(it+1,'/',len(valid),save,'DONE in',elapsed,'seconds')
+
+	print('\n',len(valid),'/',len(jobs['jobs']),'jobs DONE in',time.time()-start,'seconds')
@@ -0,0 +1,260 @@
+#!/var/lib/py27_sroche/bin/python
+ # -*- coding: ascii -*-
+
+from __future__ import print_function # allows the use of Python 3.x print(function in python 2.x code so that print('a','b') prints 'a b' and not ('a','b')
+
+####################
+# code description #
+####################
+
+"""
+Benchmark of the functions of BOKEH_comp_plot.py on synthetic time series
+
+Each case generates 'labels' time series of 'points' irregularly spaced data with gaps, and times:
+	- freq_match() with one process, with 'workers' processes, and its cache
+	- freq_match_stream() reading the data by blocks
+	- freq_bin() + pair_data() for the same pairs
+	- tolerance_match()
+	- bok_comp() and write_html() with and without binary=True, and the size of the html files
+
+The outputs of all the matching functions are checked to be identical, and for cases with at most 'check' points they are also compared with a simple loop implementation.
+With 'reference', the output of freq_match() is saved in that directory the first time, and compared with it in the following runs, so that an optimization can be validated against the results of the previous code.
+
+usage (all arguments are optional):
+python benchmark_comp_plot.py points=1000,100000 labels=2,10 FREQ='1 days' workers=4 check=10000 dashboard=1 report=benchmark.json reference=benchmark_reference
+"""
+
+####################
+# import libraries #
+####################
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import time
+
+from collections import OrderedDict
+
+# special arrays with special functions
+import numpy as np
+
+# generic functions to build a html dashboard to compare time series.
+from BOKEH_comp_plot import *
+
+#############
+# Functions #
+#############
+
+def synthetic_data(points,labels,days=365,gaps=10,gap_fraction=0.2,seed=0):
+	"""
+	returns a DATA dictionary for freq_match() with 'labels' time series {'x':[...],'y':[...]} of 'points' data each
+
+	- days is the length of the time series, starting on 2015-01-01
+	- gaps is the number of periods without data in each time series, they cover gap_fraction of the time range
+	- seed of the random number generator, the same inputs always give the same data
+
+	the times are random numpy.datetime64[us] (sorted), the values are a seasonal cycle with noise and an offset different for each label
+	"""
+	rng = np.random.RandomState(seed)
+
+	start = np.datetime64('2015-01-01T00:00:00','us')
+	length = days*86400*10**6
+
+	DATA = OrderedDict()
+	for it in range(labels):
+		t = np.sort(rng.randint(0,length,size=int(points/(1-gap_fraction))+1,dtype=np.int64))
+
+		# remove the data in 'gaps' periods at random positions
+		gap_length = int(length*gap_fraction/gaps)
+		gap_starts = rng.randint(0,length-gap_length,size=gaps,dtype=np.int64)
+		keep = np.ones(len(t),dtype=bool)
+		for gap_start in gap_starts:
+			keep[np.searchsorted(t,gap_start):np.searchsorted(t,gap_start+gap_length)] = False
+		t = t[keep][:points]
+
+		y = 400+2*np.sin(2*np.pi*t/(365.25*86400*10**6))+0.5*it+rng.normal(0,1,len(t))
+
+		DATA['site'+str(it)] = {'x':start+t,'y':y}
+
+	return DATA
+
+def loop_freq_match(DATA,select,FREQ,date_range=[None,None]):
+	"""
+	simple implementation of freq_match() with python loops and dictionaries, used to check the results on small data
+	"""
+	if None in date_range:
+		t0 = epoch_us(DATA[select]['x'][:1])[0]
+		tf = epoch_us(DATA[select]['x'][-1:])[0]
+	else:
+		t0 = epoch_us([parse_date(date_range[0])])[0]
+		tf = epoch_us([parse_date(date_range[1])])[0]
+
+	time_step = parse_freq(FREQ)
+	step = time_step.days*86400*10**6+time_step.seconds*10**6+time_step.microseconds
+	span = int(np.ceil((tf-t0)/float(step)))
+
+	intervals = {}
+	for label in DATA:
+		intervals[label] = {}
+		for t,y in zip(epoch_us(DATA[label]['x']),DATA[label]['y']):
+			k = (int(t)-int(t0))//step
+			if 0 <= k < span:
+				intervals[label].setdefault(k,[]).append((int(t)//10**6,float(y)))
+
+	FREQ_DATA = {}
+	for label in DATA:
+		if label == select:
+			continue
+		matched = sorted(set(intervals[label]) & set(intervals[select]))
+		if not matched:
+			continue
+		FREQ_DATA[label] = {}
+		for key in [select,label]:
+			data = [intervals[key][k] for k in matched]
+			FREQ_DATA[label][key] = {
+									'x':np.array([sum([t for t,y in d])//len(d) for d in data]).astype('datetime64[s]').astype('datetime64[ms]'),
+									'y':np.array([sum([y for t,y in d])/len(d) for d in data]),
+									}
+
+	return FREQ_DATA
+
+def same_freq_data(A,B):
+	"""
+	returns True if the two dictionaries returned by freq_match() have the same labels, times, and values (to 1e-9 relative precision)
+	"""
+	if sorted(A.keys()) != sorted(B.keys()):
+		return False
+
+	for label in A:
+		if sorted(A[label].keys()) != sorted(B[label].keys()):
+			return False
+		for key in A[label]:
+			if not np.array_equal(as_datetime64(A[label][key]['x']),as_datetime64(B[label][key]['x'])):
+				return False
+			if not np.allclose(A[label][key]['y'],B[label][key]['y'],rtol=1e-9,atol=0):
+				return False
+
+	return True
+
+def timed(function,*args,**kwargs):
+	"""
+	returns (output of function(*args,**kwargs),time spent in seconds), what the function prints is hidden
+	"""
+	stdout = sys.stdout
+	sys.stdout = open(os.devnull,'w')
+	milestone = time.time()
+	try:
+		result = function(*args,**kwargs)
+	finally:
+		elapsed = time.time()-milestone
+		sys.stdout.close()
+		sys.stdout = stdout
+
+	return result,elapsed
+
+def benchmark(points,labels,FREQ='1 days',workers=4,check=10000,dashboard=True,reference=''):
+	"""
+	run one benchmark case, returns a dictionary with the time spent in each step, the size of the html files, and the result of each check
+	"""
+	DATA = synthetic_data(points,labels)
+	select = list(DATA.keys())[0]
+	date_range = ['2015-01-01','2016-01-01']
+
+	result = OrderedDict([('points',points),('labels',labels),('FREQ',FREQ),('seconds',OrderedDict()),('checks',OrderedDict()),('html_bytes',OrderedDict())])
+	seconds = result['seconds']
+	checks = result['checks']
+
+	FREQ_DATA,seconds['freq_match'] = timed(freq_match,DATA,select,FREQ,date_range)
+
+	PARALLEL_DATA,seconds['freq_match workers='+str(workers)] = timed(freq_match,DATA,select,FREQ,date_range,workers=workers)
+	checks['workers'] = same_freq_data(FREQ_DATA,PARALLEL_DATA)
+
+	cache_dir = tempfile.mkdtemp(prefix='benchmark_cache_')
+	try:
+		timed(freq_match,DATA,select,FREQ,date_range,cache_dir=cache_dir)
+		CACHED_DATA,seconds['freq_match cached'] = timed(freq_match,DATA,select,FREQ,date_range,cache_dir=cache_dir)
+		checks['cache'] = same_freq_data(FREQ_DATA,CACHED_DATA)
+	finally:
+		shutil.rmtree(cache_dir)
+
+	blocks = [(label,DATA[label]['x'][i:i+100000],DATA[label]['y'][i:i+100000]) for label in DATA for i in range(0,len(DATA[label]['x']),100000)]
+	STREAM_DATA,seconds['freq_match_stream'] = timed(freq_match_stream,blocks,select,FREQ,date_range)
+	checks['stream'] = same_freq_data(FREQ_DATA,STREAM_DATA)
+
+	BIN_DATA,seconds['freq_bin'] = timed(freq_bin,DATA,FREQ,date_range)
+	milestone = time.time()
+	PAIR_DATA = {}
+	for label in DATA:
+		if label != select:
+			PAIR_DATA.update(pair_data(BIN_DATA,label,select))
+	seconds['pair_data'] = time.time()-milestone
+	checks['pairs'] = same_freq_data(FREQ_DATA,{label:PAIR_DATA[label] for label in PAIR_DATA if len(PAIR_DATA[label][label]['x'])})
+
+	TOLERANCE_DATA,seconds['tolerance_match'] = timed(tolerance_match,DATA,select,'30 minutes',date_range)
+
+	if points <= check:
+		LOOP_DATA,seconds['loop_freq_match'] = timed(loop_freq_match,DATA,select,FREQ,date_range)
+		checks['loop'] = same_freq_data(FREQ_DATA,LOOP_DATA)
+
+	if reference != '':
+		path = os.path.join(reference,freq_match_key(DATA,select,FREQ,date_range))
+		if os.path.isdir(path):
+			checks['reference'] = same_freq_data(FREQ_DATA,load_freq_data(path))
+		else:
+			if not os.path.isdir(reference):
+				os.makedirs(reference)
+			save_freq_data(FREQ_DATA,select,path)
+
+	if dashboard:
+		html_dir = tempfile.mkdtemp(prefix='benchmark_html_')
+		try:
+			grid,seconds['bok_comp'] = timed(bok_comp,FREQ_DATA,select)
+			for binary in [False,True]:
+				save = os.path.join(html_dir,'binary.html' if binary else 'json.html')
+				timed(write_html,grid,save=save,binary=binary)
+				result['html_bytes']['binary' if binary else 'json'] = os.path.getsize(save)
+				seconds['write_html binary' if binary else 'write_html'] = timed(write_html,grid,save=save,binary=binary)[1]
+		finally:
+			shutil.rmtree(html_dir)
+
+	return result
+
+#############
+# Main code #
+#############
+
+if __name__ == "__main__":
+
+	# arguments of the form key=value
+	argu = OrderedDict([arg.split('=',1) for arg in sys.argv[1:]])
+
+	points_list = [int(float(points)) for points in argu.get('points','1000,10000,100000').split(',')]
+	labels_list = [int(labels) for labels in argu.get('labels','2,10').split(',')]
+	FREQ = argu.get('FREQ','1 days')
+	workers = int(argu.get('workers','4'))
+	check = int(float(argu.get('check','10000')))
+	dashboard = argu.get('dashboard','1') == '1'
+	reference = argu.get('reference','')
+
+	results = []
+	for points in points_list:
+		for labels in labels_list:
+			print('\n',labels,'labels of',points,'points, intervals of',FREQ)
+			results.append( benchmark(points,labels,FREQ,workers,check,dashboard,reference) )
+
+			for step in results[-1]['seconds']:
+				print('{:<30}{:>12.4f} s'.format(step,results[-1]['seconds'][step]))
+			for html in results[-1]['html_bytes']:
+				print('{:<30}{:>12d} bytes'.format('html '+html,results[-1]['html_bytes'][html]))
+			for name in results[-1]['checks']:
+				print('{:<30}{:>12}'.format('check '+name,'OK' if results[-1]['checks'][name] else 'DIFFERENT'))
+
+	if 'report' in argu:
+		with open(argu['report'],'w') as outfile:
+			json.dump(results,outfile,indent=1)
+
+	if not all([all(result['checks'].values()) for result in results]):
+		print('\nSome outputs are different')
+		sys.exit(1)
@@ -0,0 +1,180 @@
+#!/var/lib/py27_sroche/bin/python
+ # -*- coding: ascii -*-
+
+from __future__ import print_function # allows the use of Python 3.x print(function in python 2.x code so that print('a','b') prints 'a b' and not ('a','b')
+
+###################################################
+# Binary embedding of bokeh data in html files    #
+###################################################
+
+"""
+Functions shared by BOKEH_comp_plot.py and heatmap.py to write html files with the numeric data embedded as base64 typed arrays instead of JSON lists
+
+- binary_file_html(bok_obj,tab,compress=False) returns (html,report): the html page of bok_obj, with each distinct numeric column embedded once, and the byte budget of each ColumnDataSource
+- print_report(report) prints that byte budget
+- encode_column() and binary_columns() do the encoding, binary_columns_js is the script that decodes the columns in the browser
+"""
+
+#############
+# Libraries #
+#############
+
+import json
+import hashlib
+import base64
+import zlib
+
+from collections import OrderedDict
+
+# special arrays with special functions
+import numpy as np
+
+# interactive plots
+from bokeh.models import ColumnDataSource
+from bokeh.resources import CDN
+from bokeh.embed import file_html
+
+#############
+# Functions #
+#############
+
+def encode_column(values,compress=False):
+	"""
+	- values is a numeric or numpy.datetime64 numpy.array
+	- compress: if True the bytes are zlib-compressed
+
+	returns (typed array name,base64 string of the little-endian bytes), or None if the column can't be encoded
+	numpy.datetime64 are converted to float64 milliseconds since 1970-01-01 like bokeh does, integers are sent as int32 when they fit
+	"""
+	if values.dtype.kind == 'M':
+		values = values.astype('datetime64[ms]').astype(np.int64).astype('<f8')
+		array_type = 'Float64Array'
+	elif values.dtype.kind in 'iu' and len(values) and (values.min() >= -2**31) and (values.max() < 2**31):
+		values = values.astype('<i4')
+		array_type = 'Int32Array'
+	elif values.dtype.kind in 'fiu':
+		values = values.astype('<f8')
+		array_type = 'Float64Array'
+	else:
+		return None
+
+	data = np.ascontiguousarray(values).tobytes()
+	if compress:
+		data = zlib.compress(data)
+
+	return array_type,base64.b64encode(data).decode('ascii')
+
+def binary_columns(bok_obj,compress=False):
+	"""
+	encode the numeric columns of all the ColumnDataSources used by bok_obj with encode_column(), identical columns are only encoded once
+
+	returns (store,columns,report):
+		- store is a dictionary {hash:[typed array name,compressed,base64 string]}
+		- columns is a list of [source id,column name,hash] to fill the sources in the browser
+		- report is a list of dictionaries with the byte budget of each source: 'source', 'columns', 'raw_bytes' (numpy bytes), 'embedded_bytes' (base64 bytes it added to the page) and 'shared' (number of columns already embedded for another source)
+	"""
+	store = OrderedDict()
+	columns = []
+	report = []
+	for source in [model for model in bok_obj.references() if isinstance(model,ColumnDataSource)]:
+		budget = {'source':source.name if source.name else source.id,'columns':0,'raw_bytes':0,'embedded_bytes':0,'shared':0}
+		for key in source.data:
+			values = source.data[key]
+			if (not isinstance(values,np.ndarray)) or (values.ndim != 1):
+				continue
+			encoded = encode_column(values,compress)
+			if encoded is None:
+				continue
+			digest = hashlib.sha1((encoded[0]+encoded[1]).encode('ascii')).hexdigest()
+			if digest in store:
+				budget['shared'] += 1
+			else:
+				store[digest] = [encoded[0],compress,encoded[1]]
+				budget['embedded_bytes'] += len(encoded[1])
+			budget['columns'] += 1
+			budget['raw_bytes'] += values.nbytes
+			columns.append([source.id,key,digest])
+		if budget['columns']:
+			report.append(budget)
+
+	return store,columns,report
+
+# script added at the end of the html page to decode the binary columns and give them to their ColumnDataSources once bokeh has built the document
+binary_columns_js = """
+<script type="text/javascript">
+(function() {
+	var store = %s;
+	var columns = %s;
+	var array_types = {'Float64Array':Float64Array,'Int32Array':Int32Array};
+
+	function decode(entry) {
+		var text = atob(entry[2]);
+		var bytes = new Uint8Array(text.length);
+		for (var i=0; i<text.length; i++) {bytes[i] = text.charCodeAt(i);}
+		if (!entry[1]) {return Promise.resolve(new array_types[entry[0]](bytes.buffer));}
+		var stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('deflate'));
+		return new Response(stream).arrayBuffer().then(function(buffer) {return new array_types[entry[0]](buffer);});
+	}
+
+	var timer = setInterval(function() {
+		if ((typeof Bokeh === 'undefined') || (Bokeh.documents.length == 0)) {return;}
+		var doc = null;
+		for (var i=0; i<Bokeh.documents.length; i++) {
+			if (Bokeh.documents[i].get_model_by_id(columns[0][0]) != null) {doc = Bokeh.documents[i];}
+		}
+		if (doc == null) {return;}
+		clearInterval(timer);
+
+		var keys = Object.keys(store);
+		Promise.all(keys.map(function(key) {return decode(store[key]);})).then(function(arrays) {
+			var decoded = {};
+			for (var i=0; i<keys.length; i++) {decoded[keys[i]] = arrays[i];}
+
+			var new_data = {};
+			for (var i=0; i<columns.length; i++) {
+				var id = columns[i][0];
+				if (!(id in new_data)) {new_data[id] = Object.assign({},doc.get_model_by_id(id).data);}
+				new_data[id][columns[i][1]] = decoded[columns[i][2]];
+			}
+			for (var id in new_data) {doc.get_model_by_id(id).data = new_data[id];}
+		});
+	},50);
+})();
+</script>
+"""
+
+def binary_file_html(bok_obj,tab='bokeh',compress=False,store=None,columns=None):
+	"""
+	returns (html,report) for bok_obj, with its numeric columns embedded with binary_columns() and decoded by binary_columns_js
+		- "tab" is the string that will appear in the browser tab
+		- "compress" if True, the typed arrays are also zlib-compressed (decompressed by the browser with DecompressionStream)
+		- "store" and "columns" can be given if binary_columns() was already called, report is then None
+	"""
+	report = None
+	if store is None:
+		store,columns,report = binary_columns(bok_obj,compress)
+
+	# the encoded columns are emptied while the html is generated and put back afterwards
+	sources = {model.id:model for model in bok_obj.references() if isinstance(model,ColumnDataSource)}
+	original = [(source_id,key,sources[source_id].data[key]) for source_id,key,digest in columns]
+	try:
+		for source_id,key,values in original:
+			sources[source_id].data[key] = []
+		html = file_html(bok_obj,CDN,tab)
+	finally:
+		for source_id,key,values in original:
+			sources[source_id].data[key] = values
+
+	if columns:
+		html = html.replace('</body>',binary_columns_js % (json.dumps(store),json.dumps(columns))+'</body>')
+
+	return html,report
+
+def print_report(report):
+	"""
+	print the byte budget of each source returned by binary_columns(), and the total
+	"""
+	print('Source','columns','raw bytes','embedded bytes','shared columns',sep='\t')
+	for budget in report:
+		print(budget['source'],budget['columns'],budget['raw_bytes'],budget['embedded_bytes'],budget['shared'],sep='\t')
+	print('Total',sum([budget['columns'] for budget in report]),sum([budget['raw_bytes'] for budget in report]),sum([budget['embedded_bytes'] for budget in report]),sum([budget['shared'] for budget in report]),sep='\t')
@@ -16,6 +16,8 @@ Setra is the pressure sensor we used so far to process Eureka TCCON data: 0.55 h
 # import libraries #
 ####################
 
+import os
+
 # special arrays with special functions
 import numpy as np
 
@@ -26,7 +28,11 @@ from BOKEH_comp_plot import *
 # Main code #
 #############
 
-DATA = np.load('pressure_sample_data.npy').item()
+# the pickled sample data is converted once to columns that are loaded without unpickling
+if not os.path.isdir('pressure_sample_data'):
+	convert_npy('pressure_sample_data.npy','pressure_sample_data')
+
+DATA = load_columns('pressure_sample_data')
 
 title = """ 
 <div align='right'>
@@ -15,6 +15,7 @@ Example of use of the bok_comp function from BOKEH_comp_plot.py to produce a das
 # import libraries #
 ####################
 
+import os
 import sys
 
 # special arrays with special functions
@@ -30,11 +31,34 @@ import netCDF4
 #############
 
 # those two lines would generate a FREQ_DATA dictionary that would do daily matching and averaging of all sites with the 'Lamont' site
+# with cache_dir, running it again on the same data loads the result from the cache instead of matching again
+# with state='TCCON_state' instead, a nightly run only needs DATA with the new data: it is merged with the sums of previous runs saved in 'TCCON_state'
 #DATA = np.load('TCCON_sample_data_xco2.npy').item()
-#FREQ_DATA = freq_match(DATA,'Lamont','1 days',date_range=['2015-01-01','2016-01-01'],save='TCCON_sample_data_co2_freq_1_days.npy')
+#FREQ_DATA = freq_match(DATA,'Lamont','1 days',date_range=['2015-01-01','2016-01-01'],cache_dir='freq_match_cache')
+#save_columns(FREQ_DATA,'TCCON_sample_data_co2_freq_1_days')
 
+# with stats, the median, standard deviation and number of measurements of each day are also shown in the hover tool of bok_comp
+#FREQ_DATA = freq_match(DATA,'Lamont','1 days',date_range=['2015-01-01','2016-01-01'],stats=['count','median','std'])
 
-FREQ_DATA = np.load('TCCON_sample_data_co2_freq_1_days.npy').item() # this data was generated with the freq_match() function, using full time series of xCO2 from all TCCON sites (I didn't include that in the repository as it is ~70 MB)
+# for the full TCCON time series that do not fit in memory, the data can be read by blocks from the netCDF files of each site
+#from itertools import chain
+#blocks = chain(*[netcdf_blocks([site_files[site]],site,'xco2_ppm') for site in site_files]) # site_files is a dictionary {site:path to netCDF file}
+#FREQ_DATA = freq_match_stream(blocks,'Lamont','1 days',['2015-01-01','2016-01-01'])
+
+# to pair each Lamont measurement with the closest measurement of each site within 30 minutes instead of daily averages
+#FREQ_DATA = tolerance_match(DATA,'Lamont','30 minutes',date_range=['2015-01-01','2016-01-01'])
+
+# to compare all the sites with each other, the data of each site is binned only once and bok_comp can be used for any pair
+#BIN_DATA = freq_bin(DATA,'1 days',date_range=['2015-01-01','2016-01-01'])
+#write_html(bok_matrix(BIN_DATA,ylab='XCO2 (ppm)',xlab='Time (UTC)',prec='3'),tab='TCCON_XCO2_matrix',save='TCCON_XCO2_matrix.html')
+#PAIR_DATA = pair_data(BIN_DATA,'Park Falls','Lamont') # same as freq_match(DATA,'Lamont',...) for 'Park Falls'
+
+
+# the pickled sample data is converted once to columns that are loaded without unpickling
+if not os.path.isdir('TCCON_sample_data_co2_freq_1_days'):
+	convert_npy('TCCON_sample_data_co2_freq_1_days.npy','TCCON_sample_data_co2_freq_1_days')
+
+FREQ_DATA = load_columns('TCCON_sample_data_co2_freq_1_days') # this data was generated with the freq_match() function, using full time series of xCO2 from all TCCON sites (I didn't include that in the repository as it is ~70 MB)
 
 title = """ 
 <div align='right'>
@@ -58,3 +82,8 @@ Links: <a href='http://www.tccon.caltech.edu/'>TCCON</a>;
 
 write_html(bok_comp(FREQ_DATA, select='Lamont', ylab='XCO2 (ppm)', xlab='Time (UTC)', prec='3', notes=notes, sup_title=title), tab='TCCON_XCO2', save='TCCON_XCO2.html')
 
+# to see which stage takes the most time, give a Profile to each step and save its report
+#profile = Profile(memory=True)
+#write_html(bok_comp(FREQ_DATA, select='Lamont', ylab='XCO2 (ppm)', xlab='Time (UTC)', prec='3', notes=notes, sup_title=title, profile=profile), tab='TCCON_XCO2', save='TCCON_XCO2.html', profile=profile)
+#profile.save('TCCON_XCO2_profile.json')
+
@@ -1,4 +1,5 @@
 import numpy as np
+import os
 import sys
 from scipy.signal import gaussian
 
@@ -115,12 +116,32 @@ def heatmap_layout(title,fig,dumfig,select):
 
 	return final
 
-def write_html(save_path,obj):
+def write_html(save_path,obj,binary=False,compress=False):
 	"""
 	Simple function to write html file
+
+	- binary: if True, the numeric columns of the ColumnDataSources are embedded once as base64 little-endian typed arrays instead of JSON lists, the byte budget of each source is printed and returned
+	- compress: if True with binary=True, the typed arrays are also zlib-compressed
+
+	binary=True uses comp_plot/binary_html.py, the heatmap and comp_plot directories must be kept side by side (see README.md)
 	"""
+	if not binary:
+		with open(save_path,'w') as outfile:
+			outfile.write(file_html(obj,CDN,'heatmap'))
+		return
+
+	# html files with binary data, shared with comp_plot/BOKEH_comp_plot.py
+	sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','comp_plot'))
+	from binary_html import binary_file_html, print_report
+
+	html,report = binary_file_html(obj,'heatmap',compress)
+
 	with open(save_path,'w') as outfile:
-		outfile.write(file_html(obj,CDN,'heatmap'))	
+		outfile.write(html)
+
+	print_report(report)
+
+	return report
 
 if __name__ == "__main__":
 